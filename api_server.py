@@ -0,0 +1,297 @@
+# api_server.py
+"""API HTTP somente leitura das rotinas, servida do mesmo conjunto em cache do app.
+
+Rotas (GET/HEAD, respostas JSON):
+    /api/setores                          setores e quantidade de rotinas
+    /api/rotinas?setor=UTI&q=intub        lista paginada (page, page_size); q busca por relevância
+    /api/rotinas/<setor>/<chave>          uma rotina pelo setor e chave (ID_DA_ROTINA ou '#<n>')
+    /api/status                           versão e horário da carga dos dados
+
+Todas as respostas levam ETag da versão dos dados (If-None-Match devolve 304 sem corpo) e são
+compactadas com gzip quando o cliente aceita. Com SGC_API_PORT definido o app inicia o servidor junto
+com o Streamlit; também pode rodar sozinho: python api_server.py."""
+import gzip
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import streamlit as st
+
+from data_loader import get_versioned_dataset, search_rotinas
+from telemetry import TELEMETRY
+
+logger = logging.getLogger(__name__)
+
+# --- Configurações da API ---
+
+# Porta da API (0 ou vazio: desligada). Por padrão só aceita conexões locais (use um proxy reverso
+# ou SGC_API_HOST=0.0.0.0 para expor aos tablets e à intranet)
+API_PORT = int(os.environ.get('SGC_API_PORT', '0') or 0)
+API_HOST = os.environ.get('SGC_API_HOST', '127.0.0.1')
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Respostas abaixo deste tamanho não compensam a compactação
+GZIP_MIN_BYTES = 1024
+
+# Respostas prontas por (versão, URL); a versão na chave descarta as antigas sozinha
+RESPONSE_CACHE_SIZE = 256
+
+# Campos das rotinas expostos pela API (listas já separadas: passos e anexos)
+API_FIELDS = ['SETOR', 'CHAVE', 'ID_DA_ROTINA', 'TITULO_PROCEDIMENTO', 'FLUXO_PRINCIPAL', 'PASSOS',
+              'OBSERVACOES', 'ANEXOS', 'ANEXOS_TIPOS']
+
+
+class ApiError(Exception):
+    """Erro de requisição com status HTTP e mensagem para o cliente."""
+
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+
+# --- Montagem das Respostas ---
+
+def _records(df, dataset) -> list:
+    """Rotinas no formato da API, coluna a coluna (sem iterar linhas do DataFrame)."""
+    if df.empty:
+        return []
+    setores = df['SETOR'].astype(str).tolist()
+    columns = {
+        'SETOR': setores,
+        'CHAVE': [dataset.key_for_label(setor, label) for setor, label in zip(setores, df.index)],
+    }
+    for field in API_FIELDS:
+        if field not in columns:
+            columns[field] = df[field].tolist() if field in df.columns else [''] * len(df)
+    return [dict(zip(API_FIELDS, values)) for values in zip(*(columns[field] for field in API_FIELDS))]
+
+
+def _int_param(params: dict, name: str, default: int, minimum: int, maximum: int = None) -> int:
+    value = params.get(name, [''])[0]
+    if not value:
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"Parâmetro '{name}' deve ser um número inteiro.")
+    if number < minimum:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"Parâmetro '{name}' deve ser no mínimo {minimum}.")
+    return min(number, maximum) if maximum else number
+
+
+def _list_rotinas(dataset, version: int, params: dict) -> dict:
+    setor = params.get('setor', [''])[0].strip().upper() or None
+    query = params.get('q', [''])[0].strip()
+    page = _int_param(params, 'page', 1, 1)
+    page_size = _int_param(params, 'page_size', DEFAULT_PAGE_SIZE, 1, MAX_PAGE_SIZE)
+    if setor is not None and setor not in dataset.setores:
+        raise ApiError(HTTPStatus.NOT_FOUND, f"Setor '{setor}' não encontrado.")
+
+    if query:
+        df = search_rotinas(query, setor=setor)
+    elif setor is not None:
+        df = dataset.partition(setor)
+    else:
+        df = dataset.to_frame()
+
+    start = (page - 1) * page_size
+    return {
+        'versao': version,
+        'total': len(df),
+        'pagina': page,
+        'por_pagina': page_size,
+        'paginas': max(1, -(-len(df) // page_size)),
+        'rotinas': _records(df.iloc[start:start + page_size], dataset),
+    }
+
+
+def _get_rotina(dataset, version: int, setor: str, key: str) -> dict:
+    setor = setor.upper()
+    if setor not in dataset.setores:
+        raise ApiError(HTTPStatus.NOT_FOUND, f"Setor '{setor}' não encontrado.")
+    row = dataset.get_by_key(setor, key)
+    if row is None:
+        raise ApiError(HTTPStatus.NOT_FOUND, f"Rotina '{key}' não encontrada no setor '{setor}'.")
+    # row.name é o rótulo da linha: a fatia mantém os tipos da partição
+    return {'versao': version, 'rotina': _records(dataset.partition(setor).loc[[row.name]], dataset)[0]}
+
+
+def route(path: str, params: dict) -> tuple:
+    """Resolve a rota e devolve (versão dos dados, horário da carga, corpo em dict)."""
+    dataset, version, loaded_at = get_versioned_dataset()
+    parts = [unquote(part) for part in path.strip('/').split('/')]
+
+    if parts == ['api', 'status']:
+        body = {'versao': version, 'carregado_em': loaded_at.isoformat() if loaded_at is not None else None, 'rotinas': len(dataset)}
+    elif parts == ['api', 'setores']:
+        body = {'versao': version, 'setores': [{'setor': setor, 'rotinas': count} for setor, count in dataset.row_counts.items() if count]}
+    elif parts == ['api', 'rotinas']:
+        body = _list_rotinas(dataset, version, params)
+    elif len(parts) == 4 and parts[:2] == ['api', 'rotinas']:
+        body = _get_rotina(dataset, version, parts[2], parts[3])
+    else:
+        raise ApiError(HTTPStatus.NOT_FOUND, "Rota inexistente. Use /api/setores, /api/rotinas ou /api/rotinas/<setor>/<chave>.")
+    return version, loaded_at, body
+
+# --- Cache de Respostas ---
+
+class _ResponseCache:
+    """Corpos JSON (e a versão gzip, gerada na primeira vez que é pedida) por (etag, URL)."""
+
+    def __init__(self, size: int = RESPONSE_CACHE_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry: dict):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+
+RESPONSE_CACHE = _ResponseCache()
+
+
+def _etag(version: int, loaded_at) -> str:
+    """ETag fraca da versão dos dados; o horário da carga distingue versões de processos diferentes."""
+    stamp = int(loaded_at.timestamp()) if loaded_at is not None else 0
+    return f'W/"{version}-{stamp:x}"'
+
+def _accepts_gzip(accept_encoding: str) -> bool:
+    """Se o Accept-Encoding aceita gzip, respeitando os pesos (gzip;q=0 recusa)."""
+    weights = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        weight = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    weight = float(value.strip())
+                except ValueError:
+                    weight = 0.0
+        weights[coding] = weight
+    # Um 'gzip' explícito vale sobre o curinga '*'
+    return weights.get('gzip', weights.get('x-gzip', weights.get('*', 0.0))) > 0
+
+# --- Servidor HTTP ---
+
+class RotinasRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'SGC-API'
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def _respond(self, send_body: bool):
+        url = urlsplit(self.path)
+        with TELEMETRY.span('api.request', path=url.path):
+            try:
+                self._serve(url, send_body)
+            except ApiError as e:
+                TELEMETRY.increment(f"api.erro_{e.status.value}")
+                self._send(e.status, json.dumps({'erro': str(e)}, ensure_ascii=False).encode('utf-8'), send_body=send_body)
+            except Exception:
+                logger.exception("Falha na API ao responder %s", self.path)
+                TELEMETRY.increment('api.erro_500')
+                self._send(HTTPStatus.INTERNAL_SERVER_ERROR, json.dumps({'erro': 'Erro interno.'}).encode('utf-8'), send_body=send_body)
+
+    def _serve(self, url, send_body: bool):
+        # A rota é resolvida (ou achada no cache, que só guarda rotas válidas) antes do If-None-Match:
+        # rota inexistente ou parâmetro inválido nunca vira 304
+        _, version, loaded_at = get_versioned_dataset()
+        etag = _etag(version, loaded_at)
+        entry = RESPONSE_CACHE.get((etag, url.path, url.query))
+        if entry is None:
+            TELEMETRY.increment('api.cache_miss')
+            version, loaded_at, body = route(url.path, parse_qs(url.query))
+            etag = _etag(version, loaded_at)
+            entry = {'raw': json.dumps(body, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), 'gzip': None}
+            RESPONSE_CACHE.put((etag, url.path, url.query), entry)
+        else:
+            TELEMETRY.increment('api.cache_hit')
+
+        if etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+            TELEMETRY.increment('api.not_modified')
+            self._send(HTTPStatus.NOT_MODIFIED, b'', etag=etag, send_body=False)
+            return
+
+        payload, encoding = entry['raw'], None
+        if len(payload) >= GZIP_MIN_BYTES and _accepts_gzip(self.headers.get('Accept-Encoding', '')):
+            if entry['gzip'] is None:
+                entry['gzip'] = gzip.compress(payload, compresslevel=6)
+            payload, encoding = entry['gzip'], 'gzip'
+        self._send(HTTPStatus.OK, payload, etag=etag, encoding=encoding, send_body=send_body)
+
+    def _send(self, status: HTTPStatus, payload: bytes, etag: str = None, encoding: str = None, send_body: bool = True):
+        self.send_response(status)
+        if status != HTTPStatus.NOT_MODIFIED:
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(payload)))
+        if etag:
+            self.send_header('ETag', etag)
+            # Sempre revalidar: a resposta é barata de confirmar (304) e os dados mudam a qualquer edição
+            self.send_header('Cache-Control', 'no-cache')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Vary', 'Accept-Encoding')
+        self.end_headers()
+        if send_body and payload:
+            self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+def create_server(host: str = API_HOST, port: int = API_PORT) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), RotinasRequestHandler)
+    server.daemon_threads = True
+    return server
+
+
+@st.cache_resource
+def _start_server(host: str, port: int):
+    """Servidor único por processo, em uma thread em segundo plano (None se a porta estiver ocupada)."""
+    try:
+        server = create_server(host, port)
+    except OSError as e:
+        logger.warning("API de rotinas não iniciada em %s:%s: %s", host, port, e)
+        return None
+    thread = threading.Thread(target=server.serve_forever, name='sgc-api', daemon=True)
+    thread.start()
+    logger.info("API de rotinas ouvindo em http://%s:%s/api", host, server.server_port)
+    return server
+
+
+def start_api_server():
+    """Inicia a API junto com o app quando SGC_API_PORT está definido."""
+    if API_PORT > 0:
+        return _start_server(API_HOST, API_PORT)
+    return None
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+    server = create_server(API_HOST, API_PORT or 8502)
+    logger.info("API de rotinas ouvindo em http://%s:%s/api", API_HOST, server.server_port)
+    server.serve_forever()
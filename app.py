@@ -1,96 +1,198 @@
 # app.py
+import os
+
 import streamlit as st
 import pandas as pd
+from attachment_cache import AttachmentCache, DEFAULT_THUMBNAIL_WIDTH
 # Importa todas as funções de data_loader
-from data_loader import load_all_rotinas_from_drive, append_new_rotina, update_rotina, delete_rotina 
+from data_loader import load_all_rotinas_from_drive, refresh_rotinas, get_dataset_status, get_validation_report, search_rotinas, append_new_rotina, append_rotinas_batch, update_rotina, delete_rotina 
+from data_loader import SHEETS_QUOTA_PER_MINUTE, get_api_call_total, get_api_calls_per_minute, get_reload_stats
+from data_loader import get_write_status, get_write_queue_summary, flush_pending_writes, retry_failed_writes, discard_failed_writes
+from rotinas_dataset import ROW_NUMBER_COLUMN
+from import_export import IMPORT_COLUMNS, IMPORT_REQUIRED_COLUMNS, read_import_file, validate_import, export_csv_bytes
+from telemetry import TELEMETRY
+from api_server import start_api_server
+
+# --- FUNÇÕES AUXILIARES ---
+
+def format_dataset_caption(status):
+    """Monta a legenda com o horário real da carga dos dados exibidos."""
+    if status['loaded_at'] is None:
+        return "Última atualização de dados: indisponível"
+
+    caption = "Última atualização de dados: " + status['loaded_at'].strftime("%d/%m/%Y %H:%M:%S")
+    if status['source'] == 'snapshot':
+        caption += " (cópia local)"
+    if status['checked_at'] is not None and status['checked_at'] > status['loaded_at']:
+        caption += " · sem alterações na planilha até " + status['checked_at'].strftime("%H:%M:%S")
+    if status['refreshing']:
+        caption += " — sincronizando com a planilha em segundo plano..."
+    return caption
+
+# Cache local dos anexos (evita que cada navegador baixe os originais do GitHub/ImgBB)
+ATTACHMENT_CACHE_DIR = os.environ.get('SGC_ATTACHMENT_CACHE_DIR', os.path.join('.cache', 'anexos'))
+ATTACHMENT_CACHE_MAX_MB = int(os.environ.get('SGC_ATTACHMENT_CACHE_MAX_MB', '200'))
+
+
+@st.cache_resource
+def get_attachment_cache():
+    """Cache de anexos único por processo, compartilhado entre as sessões."""
+    return AttachmentCache(ATTACHMENT_CACHE_DIR, max_bytes=ATTACHMENT_CACHE_MAX_MB * 1024 * 1024)
 
 # --- FUNÇÕES DE PÁGINA ---
 
-def main_view(df_rotinas, setor_options):
+def render_anexos(anexos, tipos, titulo):
+    """Exibe os anexos de uma rotina: imagens inline, documentos e demais links como links externos."""
+    for i, (url, tipo) in enumerate(zip(anexos, tipos)):
+        st.markdown(f"#### Anexo {i + 1}")
+
+        # 1. Imagem comum (tipo já classificado na carga dos dados)
+        if tipo == 'imagem':
+            # Miniatura servida do cache local; se o anexo nunca pôde ser baixado, o navegador tenta a URL
+            thumbnail = get_attachment_cache().get_thumbnail(url, width=DEFAULT_THUMBNAIL_WIDTH)
+            st.image(thumbnail if thumbnail is not None else url, caption=f"Anexo {i + 1} para: {titulo}", width=DEFAULT_THUMBNAIL_WIDTH)
+            st.markdown(f"[🔍 Abrir imagem em tamanho original]({url})")
+        
+        # 2. Se for PDF, DOC, etc., exibe apenas o link
+        elif tipo == 'documento':
+            st.info("Este anexo é um documento (PDF/Word). Clique no link abaixo para abrir em uma nova aba:")
+            st.markdown(f"**[🔗 Abrir Documento Anexado]({url})**")
+        
+        # 3. Qualquer outro tipo de link
+        else:
+            st.markdown(f"**[🔗 Abrir Anexo Externo]({url})**")
+            st.caption("O formato do anexo não é uma imagem comum, abrindo como link externo.")
+        
+        st.markdown("---")
+
+
+def render_rotinas(df_filtered, show_setor=False):
+    """Exibe os cartões das rotinas filtradas (título, ID, fluxo, observações, anexos e passos)."""
+    write_status = get_write_status()
+    for index, row in df_filtered.iterrows():
+        st.markdown(f"### 📋 {row['TITULO_PROCEDIMENTO']}")
+        if show_setor:
+            st.caption(f"Setor: **{row['SETOR']}**")
+        status = write_status.get((row['SETOR'], int(row[ROW_NUMBER_COLUMN])))
+        if status:
+            st.caption(WRITE_STATUS_LABELS[status])
+        
+        col1, col2 = st.columns([1, 2])
+        with col1:
+            st.metric("ID da Rotina", row['ID_DA_ROTINA'])
+            st.markdown(f"**🔗 Fluxo Tasy:** **{row['FLUXO_PRINCIPAL']}**") 
+        with col2:
+            st.warning(f"⚠️ Observações: {row['OBSERVACOES']}" if row['OBSERVACOES'] else "Sem observações críticas.")
+
+        # --- BLOCO ANEXOS: lista de URLs e tipos pré-calculados na carga (separador: vírgula) ---
+        if len(row['ANEXOS']):
+            # Expander com estado: os anexos só são baixados/renderizados quando ele é aberto
+            anexos = st.expander(f"🖼️ Clique para visualizar {len(row['ANEXOS'])} Anexo(s)/Fluxograma(s)", key=f"anexos_{row['SETOR']}_{index}", on_change="rerun")
+            if anexos.open:
+                with anexos:
+                    render_anexos(row['ANEXOS'], row['ANEXOS_TIPOS'], row['TITULO_PROCEDIMENTO'])
+        # --- FIM BLOCO ANEXOS ---
+
+        st.markdown("#### 🚀 Passo a Passo Objetivo:")
+        for i, passo in enumerate(row['PASSOS']):
+            st.markdown(f"*{i+1}.* **{passo}**")
+        
+        st.markdown("---") 
+
+
+# Situação das alterações ainda não gravadas no Sheets (fila de gravação)
+WRITE_STATUS_LABELS = {
+    'pending': "⏳ Alteração salva, aguardando gravação no Google Sheets.",
+    'failed': "❌ A gravação desta alteração no Google Sheets falhou. Veja a Fila de Gravação na área administrativa.",
+}
+
+
+def paginate(df_filtered, context_key):
+    """Controles de paginação na barra lateral; retorna apenas a fatia da página atual.
+
+    A chave do seletor de página inclui o contexto (setor/busca), voltando à página 1 quando ele muda."""
+    total = len(df_filtered)
+    page_size = st.sidebar.selectbox("📄 Rotinas por página", PAGE_SIZE_OPTIONS, index=PAGE_SIZE_OPTIONS.index(DEFAULT_PAGE_SIZE), key='page_size')
+    total_pages = max(1, -(-total // page_size))
+
+    page = 1
+    if total_pages > 1:
+        page = st.sidebar.number_input(f"Página (de {total_pages})", min_value=1, max_value=total_pages, value=1, step=1, key=f"page_{context_key}")
+
+    start = (page - 1) * page_size
+    end = min(start + page_size, total)
+    if total:
+        st.caption(f"Exibindo rotinas {start + 1}–{end} de {total} (página {page} de {total_pages}).")
+    return df_filtered.iloc[start:end]
+
+
+# Opção do menu lateral que busca em todos os setores ao mesmo tempo
+GLOBAL_SEARCH_OPTION = "🌐 Busca Global (Todos os Setores)"
+
+# Paginação da lista de rotinas (o custo de renderização acompanha o tamanho da página)
+PAGE_SIZE_OPTIONS = [10, 20, 50, 100]
+DEFAULT_PAGE_SIZE = 20
+
+# Pausa na digitação antes de a busca ser enviada (evita uma execução por tecla)
+SEARCH_DEBOUNCE = "300ms"
+
+
+def main_view():
     """Lógica da Página de Visualização de Rotinas (Read) - Final e Corrigido"""
     st.header("🔍 Visualização de Rotinas do SGC Hospitalar")
-    
+    rotinas_fragment()
+
+
+@st.fragment
+def rotinas_fragment():
+    """Seleção de setor, busca e lista de rotinas. Como fragmento, mudar o setor, digitar na busca
+    ou trocar de página reexecuta apenas esta área, e não o cabeçalho, o botão de atualização e a carga."""
+    # Referência ao conjunto em cache (sem custo): pega a versão mais recente a cada execução do fragmento
+    dataset = load_all_rotinas_from_drive()
+    setor_options = dataset.setores
+
     st.sidebar.header("🧭 Navegação por Setor")
-    menu_options = ["— Selecione um Setor —"] + setor_options
+    menu_options = ["— Selecione um Setor —", GLOBAL_SEARCH_OPTION] + setor_options
     selected_setor = st.sidebar.selectbox("Escolha a Área de Interesse", menu_options)
     st.markdown("---")
 
     if selected_setor == "— Selecione um Setor —":
         st.header("Seja bem-vindo(a) ao Guia de Rotinas Tasy/SGC")
-        st.info(f"Use o menu lateral para acessar as rotinas específicas de cada uma das **{len(setor_options)}** áreas.")
+        st.info(f"Use o menu lateral para acessar as rotinas específicas de cada uma das **{len(setor_options)}** áreas ou buscar em todas elas.")
         st.markdown("##### Foco em Ação, Não em Burocracia.")
-        st.caption("Última atualização de dados: " + pd.Timestamp.now().strftime("%d/%m/%Y %H:%M:%S"))
+        st.caption(format_dataset_caption(get_dataset_status()))
     else:
+        global_search = selected_setor == GLOBAL_SEARCH_OPTION
+        search_label = "🔎 Buscar em Todos os Setores" if global_search else f"🔎 Buscar em Rotinas de {selected_setor}"
+
         st.sidebar.markdown("---")
-        search_query = st.sidebar.text_input(f"🔎 Buscar em Rotinas de {selected_setor}", help="Busca no Título do Procedimento e nas Ações/Passos.")
-        
-        st.header(f"Setor: {selected_setor} Rotinas Tasy")
-        df_filtered = df_rotinas[df_rotinas['SETOR'] == selected_setor].copy()
-
-        if search_query:
-            search_query = search_query.lower()
-            df_filtered = df_filtered[
-                df_filtered['TITULO_PROCEDIMENTO'].astype(str).str.lower().str.contains(search_query) | 
-                df_filtered['ACOES'].astype(str).str.lower().str.contains(search_query)
-            ]
-        
-        st.subheader(f"Total de Rotinas Encontradas: {len(df_filtered)}")
+        search_query = st.sidebar.text_input(search_label, type="search", live=SEARCH_DEBOUNCE, help="Busca no Título, Fluxo, Ações/Passos e Observações, sem diferenciar acentos ou maiúsculas. Aceita início de palavras (ex.: 'intub').")
         
-        if not df_filtered.empty:
-            for index, row in df_filtered.iterrows():
-                st.markdown(f"### 📋 {row['TITULO_PROCEDIMENTO']}")
-                acoes_str = row['ACOES']
-                acoes_list = acoes_str.split('#') if isinstance(acoes_str, str) and '#' in acoes_str else [acoes_str]
-                
-                col1, col2 = st.columns([1, 2])
-                with col1:
-                    st.metric("ID da Rotina", row['ID_DA_ROTINA'])
-                    st.markdown(f"**🔗 Fluxo Tasy:** **{row['FLUXO_PRINCIPAL']}**") 
-                with col2:
-                    st.warning(f"⚠️ Observações: {row['OBSERVACOES']}" if row['OBSERVACOES'] else "Sem observações críticas.")
-
-                # --- BLOCO CORRIGIDO FINAL: Exibição de MÚLTIPLOS Anexos ---
-                image_url_string = row.get('URL_IMAGEM')
-                
-                if image_url_string and str(image_url_string).strip():
-                    # Usa a vírgula (,) como separador para múltiplas URLs
-                    url_list = [url.strip() for url in image_url_string.split(',') if url.strip()]
-                    
-                    if url_list:
-                        with st.expander(f"🖼️ Clique para visualizar {len(url_list)} Anexo(s)/Fluxograma(s)"):
-                            
-                            for i, url in enumerate(url_list):
-                                st.markdown(f"#### Anexo {i + 1}")
-                                
-                                # NOVO: Limpa parâmetros de query (?raw=true) antes de verificar a extensão
-                                clean_url = url.split('?')[0] 
-                                clean_url_lower = clean_url.lower()
-
-                                # 1. Verifica se é uma URL de imagem comum
-                                if clean_url_lower.endswith(('.png', '.jpg', '.jpeg', '.webp')):
-                                    st.image(url, caption=f"Anexo {i + 1} para: {row['TITULO_PROCEDIMENTO']}", width=400)
-                                
-                                # 2. Se for PDF, DOC, etc., exibe apenas o link
-                                elif clean_url_lower.endswith(('.pdf', '.doc', '.docx')):
-                                    st.info("Este anexo é um documento (PDF/Word). Clique no link abaixo para abrir em uma nova aba:")
-                                    st.markdown(f"**[🔗 Abrir Documento Anexado]({url})**")
-                                
-                                # 3. Qualquer outro tipo de link (Ação original que estava sendo ativada indevidamente)
-                                else:
-                                    st.markdown(f"**[🔗 Abrir Anexo Externo]({url})**")
-                                    st.caption("O formato do anexo não é uma imagem comum, abrindo como link externo.")
-                                
-                                st.markdown("---") 
-                # --- FIM BLOCO ANEXOS ---
-
-                st.markdown("#### 🚀 Passo a Passo Objetivo:")
-                for i, passo in enumerate(acoes_list):
-                     if passo and passo.strip():
-                        st.markdown(f"*{i+1}.* **{passo.strip()}**")
-                
-                st.markdown("---") 
+        if global_search:
+            st.header("Busca Global em Todos os Setores")
         else:
-            st.warning("Nenhuma rotina encontrada com os filtros selecionados.")
+            st.header(f"Setor: {selected_setor} Rotinas Tasy")
+
+        with TELEMETRY.span('ui.view.filtro', busca=bool(search_query)):
+            if search_query:
+                df_filtered = search_rotinas(search_query, setor=None if global_search else selected_setor)
+            elif global_search:
+                df_filtered = None
+                st.info("Digite um termo na busca lateral para procurar rotinas em todos os setores.")
+            else:
+                # Partição do setor servida sem cópia pelo conjunto de dados
+                df_filtered = dataset.partition(selected_setor)
+        
+        if df_filtered is not None:
+            st.subheader(f"Total de Rotinas Encontradas: {len(df_filtered)}")
+            
+            if not df_filtered.empty:
+                st.sidebar.markdown("---")
+                with TELEMETRY.span('ui.view.render'):
+                    df_page = paginate(df_filtered, f"{selected_setor}_{search_query}")
+                    render_rotinas(df_page, show_setor=global_search)
+            else:
+                st.warning("Nenhuma rotina encontrada com os filtros selecionados.")
             
     st.sidebar.caption("Lembrete LGPD: SGC lida apenas com metadados de processos, sem Dados Pessoais.")
 
@@ -141,46 +243,86 @@ def create_rotina_tab(setor_options):
                 "URL_IMAGEM": anexo_url
             }
             
-            with st.spinner(f"Salvando rotina no Sheets na aba {selected_setor}..."):
+            with st.spinner(f"Salvando rotina na aba {selected_setor}..."):
                 if append_new_rotina(data_to_save, selected_setor):
-                    load_all_rotinas_from_drive.clear()
-                    st.success(f"Rotina '{titulo}' salva com sucesso! Pressione 'Atualizar Dados Agora' na Visualização para ver a mudança.")
+                    st.success(f"Rotina '{titulo}' salva com sucesso! Ela já está disponível na Visualização e será gravada no Sheets em instantes.")
                 else:
                     st.warning("Falha ao salvar. Verifique logs ou credenciais.")
 
 
-def edit_rotina_tab(df_rotinas):
+def pick_rotina(dataset, setor_options):
+    """Seletor de rotina por setor com busca por digitação. Retorna (setor, chave) ou (None, None).
+
+    As opções vêm do índice por (SETOR, ID_DA_ROTINA) do conjunto de dados, sem percorrer as linhas."""
+    col_setor, col_busca = st.columns([1, 2])
+    with col_setor:
+        sheet_name = st.selectbox("Setor:", options=setor_options, index=None, placeholder="— Selecione um Setor —", key='edit_setor')
+    with col_busca:
+        query = st.text_input("Buscar Rotina no Setor:", type="search", live=SEARCH_DEBOUNCE, key='edit_busca',
+                              disabled=sheet_name is None, help="Título, fluxo, ações ou observações; aceita início de palavras.")
+    if sheet_name is None:
+        return None, None
+
+    if query:
+        labels = search_rotinas(query, setor=sheet_name).index
+        keys = [key for key in (dataset.key_for_label(sheet_name, label) for label in labels) if key is not None]
+    else:
+        keys = dataset.rotina_keys(sheet_name)
+
+    if len(keys) > MAX_PICKER_OPTIONS:
+        st.caption(f"Exibindo {MAX_PICKER_OPTIONS} de {len(keys)} rotinas. Digite na busca para refinar.")
+        keys = keys[:MAX_PICKER_OPTIONS]
+
+    def format_option(key):
+        row = dataset.get_by_key(sheet_name, key)
+        rotina_id = row['ID_DA_ROTINA'] if not key.startswith('#') else 'sem ID único'
+        return f"{row['TITULO_PROCEDIMENTO']} — ID {rotina_id}"
+
+    key = st.selectbox(f"Selecione a Rotina para Editar/Excluir ({len(keys)} encontrada(s)):", options=keys, index=None,
+                       format_func=format_option, placeholder="— Selecione uma Rotina —", key=f'edit_rotina_{sheet_name}')
+    return sheet_name, key
+
+
+# Limite de opções no seletor de rotinas (acima disso, a busca refina a lista)
+MAX_PICKER_OPTIONS = 300
+
+
+def edit_rotina_tab(dataset, setor_options):
     """Lógica da Sub-Aba para Edição/Exclusão de Rotinas Existentes (Update/Delete)"""
     st.subheader("Alterar ou Excluir Rotina Existente")
-    st.info("Selecione uma rotina para carregar, editar ou deletar seus dados.")
-    
-    # 1. SELEÇÃO DA ROTINA
-    rotina_tuples = [(f"{row['TITULO_PROCEDIMENTO']} ({row['SETOR']})", row['TITULO_PROCEDIMENTO']) 
-                     for index, row in df_rotinas.iterrows()]
-    display_options = ["— Selecione uma Rotina —"] + [t[0] for t in rotina_tuples]
-    selected_display_option = st.selectbox("Selecione a Rotina para Editar/Excluir:", options=display_options, key='edit_selectbox')
+    st.info("Selecione o setor e a rotina (ou busque pelo nome) para carregar, editar ou deletar seus dados.")
     
-    if selected_display_option == "— Selecione uma Rotina —": return
-    
-    selected_title = selected_display_option.split(' (')[0]
-    current_data = df_rotinas[df_rotinas['TITULO_PROCEDIMENTO'] == selected_title].iloc[0]
-    sheet_name = current_data['SETOR']
-    initial_acoes = current_data['ACOES'].replace('#', '\n') if isinstance(current_data['ACOES'], str) else ""
+    # 1. SELEÇÃO DA ROTINA (índice por setor + ID, busca por digitação)
+    sheet_name, rotina_key = pick_rotina(dataset, setor_options)
+    if rotina_key is None: return
+
+    # 2. CARGA DO REGISTRO (consulta O(1) pela chave)
+    current_data = dataset.get_by_key(sheet_name, rotina_key)
+    if current_data is None:
+        st.warning("A rotina selecionada não existe mais nesta versão dos dados. Selecione novamente.")
+        return
+    selected_title = current_data['TITULO_PROCEDIMENTO']
+    initial_acoes = current_data['ACOES_TEXTO']
     initial_anexo_url = current_data.get('URL_IMAGEM', '') 
+    # Campos do formulário com chave por rotina: trocar de rotina recarrega os valores
+    form_key = f"{sheet_name}_{rotina_key}"
 
     st.markdown("---")
     st.caption(f"Rotina Selecionada: **{current_data['TITULO_PROCEDIMENTO']}** na aba **{sheet_name}**")
+    write_status = get_write_status().get((sheet_name, int(current_data[ROW_NUMBER_COLUMN])))
+    if write_status:
+        st.caption(WRITE_STATUS_LABELS[write_status])
     
     # 3. FORMULÁRIO DE EDIÇÃO (Lógica de Update DENTRO)
     with st.form(key='edit_rotina_form'):
         
-        titulo = st.text_input("1. Título do Procedimento (TITULO_PROCEDIMENTO):", value=current_data['TITULO_PROCEDIMENTO'], key='edit_titulo_input')
+        titulo = st.text_input("1. Título do Procedimento (TITULO_PROCEDIMENTO):", value=current_data['TITULO_PROCEDIMENTO'], key=f'edit_titulo_input_{form_key}')
         col1, col2 = st.columns(2)
-        with col1: id_rotina = st.text_input("2. ID da Rotina:", value=current_data['ID_DA_ROTINA'], key='edit_id_input')
-        with col2: fluxo_principal = st.text_input("3. Fluxo Principal:", value=current_data['FLUXO_PRINCIPAL'], key='edit_fluxo_input')
-        acoes = st.text_area("4. Ações/Passo a Passo:", value=initial_acoes, key='edit_acoes_input', height=250)
-        observacoes = st.text_area("5. Observações:", value=current_data['OBSERVACOES'], key='edit_obs_input')
-        anexo_url = st.text_input("URL do Anexo (Links Diretos Separados por Vírgula):", value=initial_anexo_url, key='edit_anexo_url')
+        with col1: id_rotina = st.text_input("2. ID da Rotina:", value=current_data['ID_DA_ROTINA'], key=f'edit_id_input_{form_key}')
+        with col2: fluxo_principal = st.text_input("3. Fluxo Principal:", value=current_data['FLUXO_PRINCIPAL'], key=f'edit_fluxo_input_{form_key}')
+        acoes = st.text_area("4. Ações/Passo a Passo:", value=initial_acoes, key=f'edit_acoes_input_{form_key}', height=250)
+        observacoes = st.text_area("5. Observações:", value=current_data['OBSERVACOES'], key=f'edit_obs_input_{form_key}')
+        anexo_url = st.text_input("URL do Anexo (Links Diretos Separados por Vírgula):", value=initial_anexo_url, key=f'edit_anexo_url_{form_key}')
         
         uploaded_file = st.file_uploader("Upload de Imagem para PRÉ-VISUALIZAÇÃO:", type=['png', 'jpg', 'jpeg'], key='temp_file_uploader_edit')
         if uploaded_file is not None:
@@ -204,10 +346,9 @@ def edit_rotina_tab(df_rotinas):
                     "URL_IMAGEM": anexo_url
                 }
                 
-                with st.spinner(f"Atualizando rotina no Sheets na aba {sheet_name}..."):
-                    if update_rotina(sheet_name, current_data['TITULO_PROCEDIMENTO'], data_to_update):
-                        load_all_rotinas_from_drive.clear() 
-                        st.success(f"Rotina '{titulo}' atualizada com sucesso na aba '{sheet_name}'!")
+                with st.spinner(f"Atualizando rotina na aba {sheet_name}..."):
+                    if update_rotina(sheet_name, rotina_key, data_to_update):
+                        st.success(f"Rotina '{titulo}' atualizada com sucesso na aba '{sheet_name}'! A gravação no Sheets segue em segundo plano.")
                         st.rerun() 
                     else:
                         st.warning("Falha ao atualizar. Verifique logs ou credenciais.")
@@ -221,13 +362,116 @@ def edit_rotina_tab(df_rotinas):
         
         if st.button(f"CONFIRMAR EXCLUSÃO: {selected_title}", type="secondary", key="confirm_delete_button"):
             with st.spinner(f"Excluindo rotina '{selected_title}' na aba {sheet_name}..."):
-                if delete_rotina(sheet_name, selected_title):
-                    load_all_rotinas_from_drive.clear()
-                    st.success(f"Rotina '{selected_title}' DELETADA com sucesso! Recarregando a página...")
+                if delete_rotina(sheet_name, rotina_key):
+                    st.success(f"Rotina '{selected_title}' DELETADA com sucesso! A exclusão no Sheets segue em segundo plano. Recarregando a página...")
                     st.rerun()
                 else:
                     st.error("Falha ao deletar. Rotina não excluída.")
 
+def import_export_tab(dataset):
+    """Lógica da Sub-Aba de Importação em Lote (CSV/XLSX) e Exportação da Base"""
+    st.subheader("Importar Rotinas em Lote")
+    st.info(f"Envie um arquivo CSV ou XLSX com as colunas **{', '.join(IMPORT_COLUMNS)}** "
+            f"(obrigatórias: {', '.join(IMPORT_REQUIRED_COLUMNS)}). Cada linha vira uma rotina na aba indicada em SETOR. "
+            "As linhas são validadas antes de qualquer gravação; cada setor é gravado com uma única chamada ao Sheets.")
+
+    uploaded_file = st.file_uploader("Arquivo de Importação:", type=['csv', 'xlsx'], key='import_file_uploader')
+    if uploaded_file is not None:
+        try:
+            df_import = read_import_file(uploaded_file, uploaded_file.name)
+        except Exception as e:
+            st.error(f"Não foi possível ler o arquivo: {e}")
+            df_import = None
+
+        if df_import is not None:
+            # Pré-visualização (dry-run): nada é gravado até a confirmação abaixo
+            preview = validate_import(df_import, dataset)
+            valid_rows = preview.valid_rows
+
+            col1, col2 = st.columns(2)
+            col1.metric("Linhas prontas para importar", len(valid_rows))
+            col2.metric("Linhas com problemas", preview.invalid_count)
+            if preview.ignored_columns:
+                st.caption(f"Colunas ignoradas: {', '.join(preview.ignored_columns)}")
+
+            st.dataframe(preview.rows, hide_index=True, width="stretch")
+
+            if not valid_rows.empty:
+                records_by_sheet = preview.records_by_sheet()
+                resumo = ", ".join(f"{setor}: {len(records)}" for setor, records in records_by_sheet.items())
+                if st.button(f"📥 Importar {len(valid_rows)} rotina(s) válidas ({resumo})", type="primary", key="import_button"):
+                    imported = 0
+                    for setor, records in records_by_sheet.items():
+                        with st.spinner(f"Gravando {len(records)} rotina(s) na aba {setor}..."):
+                            if append_rotinas_batch(records, setor):
+                                imported += len(records)
+                    if imported:
+                        st.success(f"{imported} rotina(s) importadas com sucesso! Elas já estão disponíveis na Visualização e serão gravadas no Sheets em instantes.")
+
+    st.markdown("---")
+    st.subheader("Exportar Base de Rotinas")
+    st.caption(f"{len(dataset)} rotina(s) de {len(dataset.setores)} setor(es), no mesmo formato aceito pela importação.")
+    # O arquivo só é montado (em blocos, setor a setor) quando o botão é clicado
+    st.download_button("📤 Baixar CSV de Todas as Rotinas", data=lambda: export_csv_bytes(dataset),
+                       file_name="rotinas_sgc.csv", mime="text/csv", key="export_button")
+
+def diagnostics_tab():
+    """Lógica da Sub-Aba de Diagnóstico (latências, cota da API, cache e versão dos dados)"""
+    st.subheader("Diagnóstico de Desempenho")
+    st.caption("Medições deste processo desde o último reinício (janela das latências: últimas execuções de cada etapa).")
+
+    status = get_dataset_status()
+    counters = TELEMETRY.get_counters()
+    calls_per_minute = get_api_calls_per_minute()
+    hits, misses = counters.get('dataset.cache_hit', 0), counters.get('dataset.cache_miss', 0)
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Versão dos Dados", status['version'], help=f"Origem: {status['source'] or '—'}")
+    col2.metric("Chamadas ao Sheets (último minuto)", f"{calls_per_minute} / {SHEETS_QUOTA_PER_MINUTE}")
+    col3.metric("Cache de Dados (acertos / faltas)", f"{hits} / {misses}")
+    col4.metric("Chamadas ao Sheets (total)", get_api_call_total())
+    st.progress(min(1.0, calls_per_minute / SHEETS_QUOTA_PER_MINUTE), text="Uso da cota por minuto do Google Sheets")
+    st.caption(format_dataset_caption(status))
+    if status['last_error']:
+        st.warning(f"Última falha de sincronização: {status['last_error']}")
+
+    st.markdown("##### Latência por Etapa (ms)")
+    summary = TELEMETRY.summary()
+    if summary.empty:
+        st.info("Nenhuma medição registrada ainda.")
+    else:
+        st.dataframe(summary, hide_index=True, width="stretch")
+
+    st.markdown("##### Contadores")
+    counter_rows = {**counters, **{f"reload.{key}": int(value) for key, value in get_reload_stats().items()}}
+    st.dataframe(pd.DataFrame(sorted(counter_rows.items()), columns=['CONTADOR', 'VALOR']), hide_index=True, width="stretch")
+    st.button("🔄 Atualizar Diagnóstico", key="diagnostics_refresh")
+
+def write_queue_panel():
+    """Fila de gravação no Sheets: pendências, falhas e ações (gravar agora, tentar novamente, descartar)."""
+    counts, mutations = get_write_queue_summary()
+    if mutations.empty:
+        return
+
+    icon = "❌" if counts['failed'] else "⏳"
+    with st.expander(f"{icon} Fila de Gravação no Sheets: {counts['pending']} pendente(s), {counts['failed']} com falha", expanded=bool(counts['failed'])):
+        st.caption("As alterações já aparecem na Visualização e são gravadas no Google Sheets em segundo plano, "
+                   "agrupadas por aba. Uma falha bloqueia as alterações seguintes da mesma aba até ser resolvida.")
+        st.dataframe(mutations, hide_index=True, width="stretch")
+
+        col1, col2, col3 = st.columns(3)
+        if col1.button("💾 Gravar Agora", key="write_queue_flush", disabled=not counts['pending']):
+            with st.spinner("Gravando alterações pendentes no Sheets..."):
+                flush_pending_writes()
+            st.rerun()
+        if col2.button("🔁 Tentar Novamente as Falhas", key="write_queue_retry", disabled=not counts['failed']):
+            retry_failed_writes()
+            st.rerun()
+        if col3.button("🗑️ Descartar Falhas", key="write_queue_discard", disabled=not counts['failed'],
+                       help="Remove as alterações com falha da fila e recarrega os dados do Sheets."):
+            discard_failed_writes()
+            st.rerun()
+
 def login_screen():
     """Mostra a tela de login e verifica a senha."""
     try:
@@ -255,21 +499,30 @@ def login_screen():
     return st.session_state.get('logged_in', False)
 
 
-def admin_view(df_rotinas, setor_options):
+def admin_view(dataset, setor_options):
     """Função Principal do Módulo de Gerenciamento (Tabs) - Acesso Permitido"""
     st.header("🛠️ Gerenciamento de Rotinas (Criação e Edição/Exclusão)")
     st.success("🔒 Área protegida: Logado como Administrador.")
     st.info("Utilize as abas abaixo para gerenciar os processos hospitalares.")
+
+    validation_report = get_validation_report()
+    if not validation_report.empty:
+        with st.expander(f"⚠️ Relatório de Validação da Planilha: {int(len(validation_report))} problema(s) encontrado(s)"):
+            st.dataframe(validation_report, hide_index=True, width="stretch")
+
+    write_queue_panel()
     
-    tab1, tab2 = st.tabs(["➕ Criar Nova Rotina", "✏️ Alterar/Excluir Rotina Existente"])
+    tab1, tab2, tab3, tab4 = st.tabs(["➕ Criar Nova Rotina", "✏️ Alterar/Excluir Rotina Existente", "📦 Importar/Exportar", "📈 Diagnóstico"])
     
-    with tab1: create_rotina_tab(setor_options)
-    with tab2: edit_rotina_tab(df_rotinas) 
+    with tab1, TELEMETRY.span('ui.admin.criar'): create_rotina_tab(setor_options)
+    with tab2, TELEMETRY.span('ui.admin.editar'): edit_rotina_tab(dataset, setor_options) 
+    with tab3, TELEMETRY.span('ui.admin.importar'): import_export_tab(dataset)
+    with tab4: diagnostics_tab()
 
-def admin_controller(df_rotinas, setor_options):
+def admin_controller(dataset, setor_options):
     """Controla o acesso à área de administração."""
     if st.session_state.get('logged_in', False):
-        admin_view(df_rotinas, setor_options)
+        admin_view(dataset, setor_options)
     else:
         login_screen()
 
@@ -281,21 +534,28 @@ def main():
 
     col_refresh, col_title_info = st.columns([1, 4])
     with col_refresh:
-        if st.button("🔄 Atualizar Dados Agora", help="Força a busca e o recarregamento dos dados mais recentes da fonte (Google Drive/Planilha)."):
-            load_all_rotinas_from_drive.clear()
-            st.rerun()
+        if st.button("🔄 Atualizar Dados Agora", help="Força a busca dos dados mais recentes da fonte (Google Drive/Planilha) em segundo plano, sem bloquear a página."):
+            refresh_rotinas(force=True)
+            if get_dataset_status()['refreshing']:
+                st.toast("Atualização em andamento. Os dados atuais continuam disponíveis até a sincronização terminar.")
+            else:
+                st.toast("Os dados acabaram de ser atualizados. Aguarde alguns segundos para forçar uma nova busca.")
 
-    col_title_info.info("A página é atualizada automaticamente ao ser aberta e quando o botão 'Atualizar Dados Agora' é pressionado.")
+    col_title_info.info("Os dados são servidos imediatamente da última cópia válida e sincronizados com a planilha em segundo plano ao abrir o app ou ao pressionar 'Atualizar Dados Agora'.")
     st.markdown("---")
 
+    # API de leitura para outros sistemas (só com SGC_API_PORT definido; uma por processo)
+    start_api_server()
+
     # --- Carregamento de Dados ---
-    with st.spinner('Buscando e carregando dados do SGC Hospitalar...'):
-        df_rotinas = load_all_rotinas_from_drive()
+    with st.spinner('Buscando e carregando dados do SGC Hospitalar...'), TELEMETRY.span('ui.carga'):
+        dataset = load_all_rotinas_from_drive()
 
-    if df_rotinas.empty:
+    if dataset.empty:
         return
         
-    setor_options = sorted(df_rotinas['SETOR'].unique().tolist())
+    # Lista de setores pré-calculada pelo conjunto de dados
+    setor_options = dataset.setores
     
     # --- SELEÇÃO DE PÁGINA na Sidebar ---
     st.sidebar.header("Módulos")
@@ -303,9 +563,9 @@ def main():
     selection = st.sidebar.radio("Ir para:", PAGES_OPTIONS)
     
     if selection == "🛠️ Gerenciamento de Dados":
-        admin_controller(df_rotinas, setor_options)
+        admin_controller(dataset, setor_options)
     else:
-        main_view(df_rotinas, setor_options)
+        main_view()
 
 if __name__ == '__main__':
     main()
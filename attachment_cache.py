@@ -0,0 +1,313 @@
+# attachment_cache.py
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from dataclasses import dataclass
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow é opcional: sem ele, as imagens são servidas no tamanho original
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# --- Configurações do Cache de Anexos ---
+
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024      # limite total em disco (LRU acima disso)
+DEFAULT_REVALIDATE_SECONDS = 6 * 60 * 60   # revalida com ETag/Last-Modified após 6h
+DEFAULT_THUMBNAIL_WIDTH = 400              # mesma largura usada em st.image na visualização
+FETCH_TIMEOUT_SECONDS = 10
+
+# Após uma falha, a URL (ou o host, se inacessível) não é buscada de novo durante este intervalo
+FAILURE_COOLDOWN_SECONDS = 5 * 60
+
+# Anexos só são buscados na web (nunca file://, ftp:// etc.), inclusive em redirecionamentos
+ALLOWED_SCHEMES = ('http', 'https')
+
+# --- Busca Remota (Plugável) ---
+
+@dataclass
+class FetchResult:
+    """Resposta de um fetcher: status 200 (conteúdo novo) ou 304 (cópia local continua válida)."""
+    status: int
+    content: bytes = b''
+    etag: str = None
+    last_modified: str = None
+    content_type: str = None
+
+
+class _WebOnlyRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """Segue redirecionamentos apenas para http/https."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        if urllib.parse.urlsplit(newurl).scheme.lower() not in ALLOWED_SCHEMES:
+            raise urllib.error.HTTPError(newurl, code, "Redirecionamento para esquema não permitido", headers, fp)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+_opener = urllib.request.build_opener(_WebOnlyRedirectHandler)
+
+
+def http_fetcher(url: str, headers: dict) -> FetchResult:
+    """Fetcher padrão (urllib), com suporte a requisições condicionais. Só aceita URLs http/https."""
+    if urllib.parse.urlsplit(url).scheme.lower() not in ALLOWED_SCHEMES:
+        raise ValueError(f"Esquema de URL não permitido para anexos: {url}")
+    request = urllib.request.Request(url, headers={'User-Agent': 'SGC-Hospitalar/1.0', **headers})
+    try:
+        with _opener.open(request, timeout=FETCH_TIMEOUT_SECONDS) as response:
+            return FetchResult(
+                status=response.status,
+                content=response.read(),
+                etag=response.headers.get('ETag'),
+                last_modified=response.headers.get('Last-Modified'),
+                content_type=response.headers.get('Content-Type'),
+            )
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return FetchResult(status=304)
+        raise
+
+# --- Cache em Disco com LRU e Miniaturas ---
+
+class AttachmentCache:
+    """Baixa cada URL de anexo uma única vez, guarda em disco e gera miniaturas.
+
+    Cada URL vira um grupo de arquivos com o mesmo prefixo (hash da URL): conteúdo original,
+    metadados (ETag, Last-Modified, horário da busca) e miniaturas por largura. A ordem de uso
+    é registrada no mtime do arquivo de metadados e define a remoção (LRU) acima de max_bytes.
+
+    Falhas são lembradas por failure_cooldown segundos (por URL e, se o host não respondeu, por
+    host): nesse intervalo nenhuma sessão espera de novo pelo timeout da mesma busca."""
+
+    def __init__(self, root: str, max_bytes: int = DEFAULT_MAX_BYTES, fetcher=http_fetcher,
+                 revalidate_after: float = DEFAULT_REVALIDATE_SECONDS, failure_cooldown: float = FAILURE_COOLDOWN_SECONDS):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.fetcher = fetcher
+        self.revalidate_after = revalidate_after
+        self.failure_cooldown = failure_cooldown
+        self._lock = threading.Lock()
+        self._url_locks = defaultdict(threading.Lock)
+        # Cache negativo em memória: URL ou host -> horário até o qual não buscar de novo
+        self._failed_until = {}
+        os.makedirs(root, exist_ok=True)
+
+    # --- Caminhos ---
+
+    def _key(self, url: str) -> str:
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()[:32]
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.root, f"{key}.{suffix}")
+
+    def _read_meta(self, key: str):
+        try:
+            with open(self._path(key, 'json'), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_file(self, path: str, data: bytes):
+        """Escrita atômica para que leitores concorrentes nunca vejam arquivos pela metade."""
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    # --- Cache Negativo ---
+
+    def _host(self, url: str) -> str:
+        return 'host:' + (urllib.parse.urlsplit(url).hostname or '')
+
+    def _in_cooldown(self, url: str) -> bool:
+        now = time.time()
+        with self._lock:
+            return any(self._failed_until.get(name, 0) > now for name in (url, self._host(url)))
+
+    def _record_failure(self, url: str, host_unreachable: bool = False):
+        until = time.time() + self.failure_cooldown
+        with self._lock:
+            self._failed_until[url] = until
+            if host_unreachable:
+                self._failed_until[self._host(url)] = until
+
+    def _clear_failure(self, url: str):
+        with self._lock:
+            self._failed_until.pop(url, None)
+            self._failed_until.pop(self._host(url), None)
+
+    def _touch(self, key: str):
+        try:
+            os.utime(self._path(key, 'json'))
+        except OSError:
+            pass
+
+    # --- API Pública ---
+
+    def get(self, url: str):
+        """Bytes do anexo (do disco ou baixados agora). Retorna None se indisponível e não cacheado."""
+        key = self._key(url)
+        with self._lock:
+            url_lock = self._url_locks[key]
+
+        with url_lock:
+            meta = self._read_meta(key)
+            content_path = self._path(key, 'bin')
+            cached = meta is not None and os.path.exists(content_path)
+
+            if cached and time.time() - meta.get('fetched_at', 0) < self.revalidate_after:
+                self._touch(key)
+                return self._read(content_path)
+
+            if self._in_cooldown(url):
+                return self._read(content_path) if cached else None
+
+            headers = {}
+            if cached and meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if cached and meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+            try:
+                result = self.fetcher(url, headers)
+            except Exception as e:
+                # Host inacessível: serve a cópia local, mesmo vencida, se existir
+                logger.warning("Falha ao buscar anexo %s: %s", url, e)
+                host_unreachable = isinstance(e, (urllib.error.URLError, OSError)) and not isinstance(e, urllib.error.HTTPError)
+                self._record_failure(url, host_unreachable)
+                return self._read(content_path) if cached else None
+
+            if result.status in (200, 304):
+                self._clear_failure(url)
+
+            if result.status == 304 and cached:
+                meta['fetched_at'] = time.time()
+                self._write_file(self._path(key, 'json'), json.dumps(meta).encode('utf-8'))
+                return self._read(content_path)
+
+            if result.status != 200 or not result.content:
+                logger.warning("Anexo %s retornou status %s", url, result.status)
+                self._record_failure(url)
+                return self._read(content_path) if cached else None
+
+            # Só imagens vão para o cache (ex.: um link .png que devolve a página HTML do GitHub)
+            if not _is_image(result):
+                logger.warning("Anexo %s não é uma imagem (Content-Type: %s)", url, result.content_type)
+                self._record_failure(url)
+                return self._read(content_path) if cached else None
+
+            self._store(key, url, result)
+
+        self._evict()
+        return result.content
+
+    def get_thumbnail(self, url: str, width: int = DEFAULT_THUMBNAIL_WIDTH):
+        """Miniatura do anexo com a largura pedida (gerada uma vez e guardada em disco). None se o
+        anexo não puder ser baixado ou decodificado: quem chama recorre à URL."""
+        content = self.get(url)
+        if content is None or Image is None:
+            return content
+
+        key = self._key(url)
+        thumb_path = self._path(key, f"w{width}")
+        if os.path.exists(thumb_path):
+            return self._read(thumb_path)
+
+        try:
+            thumbnail = _make_thumbnail(content, width)
+        except Exception as e:
+            logger.warning("Não foi possível gerar miniatura de %s: %s", url, e)
+            return None
+
+        self._write_file(thumb_path, thumbnail)
+        self._evict()
+        return thumbnail
+
+    # --- Armazenamento e Remoção ---
+
+    def _read(self, path: str):
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _store(self, key: str, url: str, result: FetchResult):
+        # Conteúdo novo invalida as miniaturas antigas
+        for name in os.listdir(self.root):
+            if name.startswith(f"{key}.w"):
+                os.remove(os.path.join(self.root, name))
+
+        self._write_file(self._path(key, 'bin'), result.content)
+        meta = {
+            'url': url,
+            'etag': result.etag,
+            'last_modified': result.last_modified,
+            'content_type': result.content_type,
+            'fetched_at': time.time(),
+        }
+        self._write_file(self._path(key, 'json'), json.dumps(meta).encode('utf-8'))
+
+    def _evict(self):
+        """Remove os grupos usados há mais tempo até o total em disco caber em max_bytes."""
+        with self._lock:
+            groups = defaultdict(lambda: {'size': 0, 'last_used': 0.0})
+            for entry in os.scandir(self.root):
+                if not entry.is_file() or entry.name.endswith('.tmp'):
+                    continue
+                key = entry.name.split('.', 1)[0]
+                stat = entry.stat()
+                groups[key]['size'] += stat.st_size
+                if entry.name.endswith('.json'):
+                    groups[key]['last_used'] = stat.st_mtime
+
+            total = sum(group['size'] for group in groups.values())
+            for key, group in sorted(groups.items(), key=lambda item: item[1]['last_used']):
+                if total <= self.max_bytes:
+                    break
+                for name in os.listdir(self.root):
+                    if name.startswith(f"{key}."):
+                        try:
+                            os.remove(os.path.join(self.root, name))
+                        except OSError:
+                            pass
+                total -= group['size']
+
+
+def _is_image(result: FetchResult) -> bool:
+    """Se o conteúdo baixado é uma imagem: Content-Type image/* (quando informado) e, com Pillow,
+    decodificável. Sem Pillow, o Content-Type image/* é obrigatório."""
+    content_type = (result.content_type or '').split(';')[0].strip().lower()
+    if content_type and not content_type.startswith('image/'):
+        return False
+    if Image is None:
+        return bool(content_type)
+    try:
+        with Image.open(io.BytesIO(result.content)) as image:
+            image.verify()
+        return True
+    except Exception:
+        return False
+
+
+def _make_thumbnail(content: bytes, width: int) -> bytes:
+    """Reduz a imagem para a largura pedida, mantendo proporção e formato (imagens menores não mudam)."""
+    with Image.open(io.BytesIO(content)) as image:
+        if image.width <= width:
+            return content
+        image_format = image.format if image.format in ('PNG', 'JPEG', 'WEBP') else 'PNG'
+        height = max(1, round(image.height * width / image.width))
+        thumbnail = image.resize((width, height), Image.LANCZOS)
+        if image_format == 'JPEG' and thumbnail.mode not in ('RGB', 'L'):
+            thumbnail = thumbnail.convert('RGB')
+        buffer = io.BytesIO()
+        thumbnail.save(buffer, format=image_format)
+        return buffer.getvalue()
@@ -0,0 +1,229 @@
+# benchmarks/fake_gspread.py
+import random
+import threading
+import time
+from collections import Counter
+
+import gspread.exceptions
+import gspread.utils
+
+# --- Planilha Simulada em Memória (mesma superfície do gspread usada pelo data_loader) ---
+
+class _FakeResponse:
+    """Resposta HTTP mínima para montar um gspread.exceptions.APIError."""
+
+    def __init__(self, code: int, message: str, status: str = 'RESOURCE_EXHAUSTED'):
+        self.status_code = code
+        self.text = message
+        self._payload = {'error': {'code': code, 'message': message, 'status': status}}
+
+    def json(self):
+        return self._payload
+
+
+class FakeBackend:
+    """Latência, erros de cota e contagem de chamadas compartilhados por cliente, planilha e abas.
+
+    - latency: segundos de espera por chamada (mais jitter aleatório de até `jitter` segundos);
+    - quota_error_rate: probabilidade de cada chamada falhar com 429;
+    - quota_per_minute: limite de chamadas em 60s (acima dele, 429 como na API real)."""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, quota_error_rate: float = 0.0,
+                 quota_per_minute: int = None, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.quota_error_rate = quota_error_rate
+        self.quota_per_minute = quota_per_minute
+        self.calls = Counter()
+        self.quota_errors = 0
+        self._random = random.Random(seed)
+        self._recent = []
+        self._lock = threading.Lock()
+
+    def call(self, operation: str):
+        with self._lock:
+            self.calls[operation] += 1
+            now = time.monotonic()
+            self._recent = [t for t in self._recent if now - t < 60]
+            over_quota = self.quota_per_minute is not None and len(self._recent) >= self.quota_per_minute
+            self._recent.append(now)
+            fail = over_quota or self._random.random() < self.quota_error_rate
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            if fail:
+                self.quota_errors += 1
+
+        if delay:
+            time.sleep(delay)
+        if fail:
+            raise gspread.exceptions.APIError(_FakeResponse(429, f"Quota exceeded ({operation})"))
+
+
+class FakeWorksheet:
+    """Aba com os valores em memória (lista de linhas, cabeçalho na linha 1)."""
+
+    def __init__(self, spreadsheet, title: str, values: list, sheet_id: int = 0):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.values = values
+        self.id = sheet_id
+
+    def _call(self, operation: str):
+        self.spreadsheet.backend.call(operation)
+
+    def _written(self, first_row: int, rows: list):
+        self.spreadsheet.touch()
+        width = max((len(row) for row in rows), default=1)
+        start = gspread.utils.rowcol_to_a1(first_row, 1)
+        end = gspread.utils.rowcol_to_a1(first_row + len(rows) - 1, width)
+        return {'updates': {'updatedRange': f"'{self.title}'!{start}:{end}", 'updatedRows': len(rows)}}
+
+    def row_values(self, row: int, **kwargs) -> list:
+        self._call('row_values')
+        return list(self.values[row - 1]) if 0 < row <= len(self.values) else []
+
+    def col_values(self, col: int, **kwargs) -> list:
+        self._call('col_values')
+        return [row[col - 1] if len(row) >= col else '' for row in self.values]
+
+    def batch_get(self, ranges: list, **kwargs) -> list:
+        """Leitura de várias células (só intervalos de uma célula são simulados)."""
+        self._call('batch_get')
+        found = []
+        for range_name in ranges:
+            row, col = gspread.utils.a1_to_rowcol(range_name.split('!')[-1])
+            value = self.values[row - 1][col - 1] if row <= len(self.values) and col <= len(self.values[row - 1]) else ''
+            found.append([[value]] if value != '' else [])
+        return found
+
+    def append_row(self, values: list, value_input_option=None, **kwargs) -> dict:
+        self._call('append_row')
+        self.values.append([str(value) for value in values])
+        return self._written(len(self.values), [values])
+
+    def append_rows(self, values: list, value_input_option=None, **kwargs) -> dict:
+        self._call('append_rows')
+        first_row = len(self.values) + 1
+        self.values.extend([str(value) for value in row] for row in values)
+        return self._written(first_row, values)
+
+    def update(self, range_name: str, values: list, value_input_option=None, **kwargs) -> dict:
+        self._call('update')
+        first_row = gspread.utils.a1_to_rowcol(range_name.split(':')[0])[0]
+        for offset, row in enumerate(values):
+            self.values[first_row - 1 + offset] = [str(value) for value in row]
+        return self._written(first_row, values)
+
+    def batch_update(self, data: list, value_input_option=None, **kwargs) -> dict:
+        # Como o gspread, prefixa o nome da aba em data[i]['range'] no próprio dict recebido
+        for item in data:
+            item['range'] = gspread.utils.absolute_range_name(self.title, item['range'])
+        self._call('batch_update')
+        for item in data:
+            if item['range'].count('!') != 1:
+                raise gspread.exceptions.APIError(_FakeResponse(400, f"Unable to parse range: {item['range']}", 'INVALID_ARGUMENT'))
+        for item in data:
+            first_row, first_col = gspread.utils.a1_to_rowcol(item['range'].split('!')[-1].split(':')[0])
+            for offset, row in enumerate(item['values']):
+                current = self.values[first_row - 1 + offset]
+                current.extend([''] * (first_col - 1 + len(row) - len(current)))
+                current[first_col - 1:first_col - 1 + len(row)] = [str(value) for value in row]
+        self.spreadsheet.touch()
+        return {'totalUpdatedRows': sum(len(item['values']) for item in data)}
+
+    def delete_rows(self, start_index: int, end_index: int = None) -> dict:
+        self._call('delete_rows')
+        end_index = end_index or start_index
+        del self.values[start_index - 1:end_index]
+        self.spreadsheet.touch()
+        return {}
+
+
+class FakeSpreadsheet:
+    """Planilha com várias abas, leitura em lote e horário de modificação (Drive)."""
+
+    def __init__(self, backend: FakeBackend, tabs: dict, spreadsheet_id: str = 'benchmark'):
+        self.backend = backend
+        self.id = spreadsheet_id
+        self._worksheets = {title: FakeWorksheet(self, title, values, position) for position, (title, values) in enumerate(tabs.items())}
+        self._modified = 0
+
+    def touch(self):
+        self._modified += 1
+
+    def get_lastUpdateTime(self) -> str:
+        self.backend.call('get_lastUpdateTime')
+        return f"2024-01-01T00:00:{self._modified:08d}Z"
+
+    def worksheets(self, **kwargs) -> list:
+        self.backend.call('worksheets')
+        return list(self._worksheets.values())
+
+    def worksheet(self, title: str):
+        self.backend.call('worksheet')
+        if title not in self._worksheets:
+            raise gspread.exceptions.WorksheetNotFound(title)
+        return self._worksheets[title]
+
+    def batch_update(self, body: dict) -> dict:
+        """spreadsheets.batchUpdate; só deleteDimension de linhas é simulado."""
+        self.backend.call('batch_update_spreadsheet')
+        by_id = {worksheet.id: worksheet for worksheet in self._worksheets.values()}
+        for request in body.get('requests', []):
+            dimension = request['deleteDimension']['range']
+            del by_id[dimension['sheetId']].values[dimension['startIndex']:dimension['endIndex']]
+        self.touch()
+        return {'spreadsheetId': self.id, 'replies': [{} for _ in body.get('requests', [])]}
+
+    def values_batch_get(self, ranges: list, params: dict = None) -> dict:
+        self.backend.call('values_batch_get')
+        value_ranges = []
+        for range_name in ranges:
+            title = range_name.split('!')[0].strip("'").replace("''", "'")
+            values = self._worksheets[title].values if title in self._worksheets else []
+            value_ranges.append({'range': range_name, 'values': [list(row) for row in values]})
+        return {'spreadsheetId': self.id, 'valueRanges': value_ranges}
+
+
+class FakeClient:
+    """Cliente autenticado simulado (substitui o retorno de gspread.service_account_from_dict)."""
+
+    def __init__(self, backend: FakeBackend, tabs: dict):
+        self.backend = backend
+        self._spreadsheet = FakeSpreadsheet(backend, tabs)
+
+    def open_by_key(self, key: str) -> FakeSpreadsheet:
+        self.backend.call('open_by_key')
+        return self._spreadsheet
+
+# --- Dados Sintéticos ---
+
+HEADERS = ['ID_DA_ROTINA', 'TITULO_PROCEDIMENTO', 'FLUXO_PRINCIPAL', 'ACOES', 'OBSERVACOES', 'URL_IMAGEM']
+
+_WORDS = ['admissão', 'alta', 'transferência', 'intubação', 'curativo', 'medicação', 'prescrição', 'coleta',
+          'exame', 'laudo', 'leito', 'triagem', 'cadastro', 'autorização', 'cirurgia', 'higienização',
+          'equipamento', 'plantão', 'visita', 'prontuário', 'agendamento', 'óbito', 'isolamento', 'dieta']
+_FLUXOS = ['Atendimento', 'Internação', 'Faturamento', 'Prescrição Eletrônica', 'Gestão de Leitos', 'Suprimentos']
+
+
+def synthetic_tabs(total_rows: int, sheet_names: list, seed: int = 0) -> dict:
+    """Gera `total_rows` rotinas distribuídas igualmente entre as abas, com títulos únicos por aba."""
+    rng = random.Random(seed)
+    tabs = {}
+    per_tab, remainder = divmod(total_rows, len(sheet_names))
+    for position, sheet_name in enumerate(sheet_names):
+        count = per_tab + (1 if position < remainder else 0)
+        rows = [list(HEADERS)]
+        for i in range(count):
+            words = rng.sample(_WORDS, 3)
+            steps = '#'.join(f"{rng.choice(_WORDS).capitalize()} {rng.choice(_WORDS)}" for _ in range(rng.randint(2, 6)))
+            url = f"https://example.org/anexos/{sheet_name.lower()}_{i}.png" if i % 4 == 0 else ''
+            rows.append([
+                str(i + 1),
+                f"{' '.join(words).capitalize()} {sheet_name} {i + 1}",
+                rng.choice(_FLUXOS),
+                steps,
+                'Conferir identificação do paciente.' if i % 3 == 0 else '',
+                url,
+            ])
+        tabs[sheet_name] = rows
+    return tabs
@@ -0,0 +1,277 @@
+# benchmarks/run_benchmarks.py
+"""Benchmark da carga, busca e CRUD do data_loader contra uma planilha simulada em memória.
+
+Exemplos:
+    python benchmarks/run_benchmarks.py --sizes 100,1000,10000 --latency 0.05 --output resultados.json
+    python benchmarks/run_benchmarks.py --sizes 100000 --baseline resultados.json --max-regression 1.25
+
+Cada fase registra chamadas à API (por operação), tempo de parede e pico de memória alocada
+(tracemalloc; a memória Arrow é informada à parte). O resultado é um JSON para comparar execuções."""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Snapshot em diretório temporário e sem verificação periódica: o benchmark não toca no .cache do app
+_SNAPSHOT_DIR = tempfile.mkdtemp(prefix='sgc-bench-')
+os.environ['SGC_SNAPSHOT_PATH'] = os.path.join(_SNAPSHOT_DIR, 'rotinas_snapshot.sqlite')
+os.environ['SGC_POLL_INTERVAL_SECONDS'] = '0'
+# Fila de gravação também isolada; o worker não grava sozinho durante as fases (a fase 'flush' mede a gravação)
+os.environ['SGC_WRITE_QUEUE_PATH'] = os.path.join(_SNAPSHOT_DIR, 'write_queue.sqlite')
+os.environ['SGC_WRITE_FLUSH_DELAY_SECONDS'] = '3600'
+
+import pandas as pd
+import pyarrow as pa
+import streamlit as st
+
+import data_loader
+from fake_gspread import FakeBackend, FakeClient, synthetic_tabs
+
+DEFAULT_SIZES = [100, 1000, 10000, 100000]
+SEARCH_QUERIES = ['intub', 'alta', 'transferencia leito', 'prescricao', 'coleta exame', 'isolamento', 'curativo', 'plantao visita']
+
+# --- Instalação da Planilha Simulada ---
+
+def install_fake(client: FakeClient):
+    """Faz o data_loader usar a planilha simulada (abrir a planilha continua contando como chamada)."""
+    @st.cache_resource
+    def _get_connection():
+        sh = data_loader._api_call('open_by_key', client.open_by_key, 'benchmark')
+        return data_loader._SheetsConnection(sh)
+
+    data_loader._get_connection = _get_connection
+    _get_connection.clear()
+
+
+def reset_process_state(clear_snapshot: bool):
+    """Simula um processo novo: descarta o cache compartilhado e, se pedido, o snapshot em disco."""
+    # Como na saída do processo, o snapshot pendente é gravado antes
+    data_loader._get_snapshot_writer().flush()
+    data_loader._get_snapshot_writer.clear()
+    data_loader._get_dataset_cache.clear()
+    data_loader.API_CALL_COUNTS.clear()
+    if clear_snapshot and os.path.exists(data_loader.SNAPSHOT_PATH):
+        os.remove(data_loader.SNAPSHOT_PATH)
+
+
+def wait_for_refresh(timeout: float = 600):
+    """Aguarda a recarga em segundo plano terminar (para não medir duas fases ao mesmo tempo)."""
+    deadline = time.monotonic() + timeout
+    while data_loader.get_reload_stats()['in_flight'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+# --- Medição ---
+
+def measure(phase: str, size: int, func, track_memory: bool, operations: int = 1) -> dict:
+    """Executa func uma vez e mede tempo, chamadas à API e memória."""
+    calls_before = Counter(data_loader.API_CALL_COUNTS)
+    arrow_before = pa.total_allocated_bytes()
+    if track_memory:
+        tracemalloc.reset_peak()
+        traced_before = tracemalloc.get_traced_memory()[0]
+
+    start = time.perf_counter()
+    extra = func() or {}
+    wall = time.perf_counter() - start
+
+    calls = Counter(data_loader.API_CALL_COUNTS)
+    calls.subtract(calls_before)
+    calls = {operation: count for operation, count in calls.items() if count}
+
+    result = {
+        'size': size,
+        'phase': phase,
+        'operations': operations,
+        'wall_seconds': round(wall, 6),
+        'wall_seconds_per_op': round(wall / operations, 6),
+        'api_calls': sum(calls.values()),
+        'api_calls_by_operation': calls,
+        'arrow_bytes_delta': pa.total_allocated_bytes() - arrow_before,
+    }
+    if track_memory:
+        result['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1] - traced_before
+    result.update(extra)
+    return result
+
+
+def _latency_stats(latencies: list) -> dict:
+    ordered = sorted(latencies)
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    return {'p50_seconds': round(statistics.median(ordered), 6), 'p95_seconds': round(p95, 6)}
+
+
+def pick_targets(count: int, rng: random.Random) -> list:
+    """(aba, chave) de rotinas existentes no cache, escolhidas ao acaso."""
+    dataset = data_loader.load_all_rotinas_from_drive()
+    candidates = [(setor, key) for setor in dataset.setores for key in dataset.rotina_keys(setor)[:200]]
+    return rng.sample(candidates, min(count, len(candidates)))
+
+
+def run_size(size: int, args) -> list:
+    """Todas as fases para um tamanho de base."""
+    backend = FakeBackend(latency=args.latency, jitter=args.jitter, quota_error_rate=args.quota_error_rate,
+                          quota_per_minute=args.quota_per_minute, seed=args.seed)
+    client = FakeClient(backend, synthetic_tabs(size, data_loader.SHEET_NAMES, seed=args.seed))
+    install_fake(client)
+    rng = random.Random(args.seed)
+    results = []
+
+    def phase(name, func, operations=1):
+        result = measure(name, size, func, args.memory, operations)
+        results.append(result)
+        logging.info("%7d %-18s %8.3fs  %3d chamadas", size, name, result['wall_seconds'], result['api_calls'])
+
+    # 1. Carga a frio (sem snapshot): autenticação + leitura em lote de todas as abas
+    reset_process_state(clear_snapshot=True)
+    phase('load_cold', lambda: {'rows': len(data_loader.load_all_rotinas_from_drive())})
+    wait_for_refresh()
+
+    # 2. Reinício com snapshot: dados servidos do disco, revalidação em segundo plano (não medida)
+    reset_process_state(clear_snapshot=False)
+    phase('load_snapshot', lambda: {'rows': len(data_loader.load_all_rotinas_from_drive())})
+    wait_for_refresh()
+
+    # 3. Recarga sem mudanças na planilha (apenas a sonda de modificação)
+    phase('reload_unchanged', lambda: data_loader.refresh_rotinas(wait=True) and None)
+
+    # 4. Busca: a primeira constrói o índice, as seguintes só consultam
+    phase('search_index_build', lambda: {'results': len(data_loader.search_rotinas(SEARCH_QUERIES[0]))})
+
+    def searches():
+        latencies = []
+        for _ in range(args.repeat):
+            for query in SEARCH_QUERIES:
+                start = time.perf_counter()
+                data_loader.search_rotinas(query)
+                latencies.append(time.perf_counter() - start)
+        return _latency_stats(latencies)
+    phase('search', searches, operations=args.repeat * len(SEARCH_QUERIES))
+
+    # 5. CRUD: as alterações entram na fila e no cache (write-through) sem chamar a API
+    targets = pick_targets(args.crud_ops * 2, rng)
+    updates, deletes = targets[:args.crud_ops], targets[args.crud_ops:]
+
+    def crud(operation):
+        latencies, failures = [], 0
+        for i in range(args.crud_ops):
+            start = time.perf_counter()
+            if operation == 'update':
+                setor, key = updates[i]
+                ok = data_loader.update_rotina(setor, key, {'ACOES': f'Passo revisado {i}#Conferir'})
+            elif operation == 'append':
+                setor = data_loader.SHEET_NAMES[i % len(data_loader.SHEET_NAMES)]
+                ok = data_loader.append_new_rotina({'TITULO_PROCEDIMENTO': f'Rotina benchmark {i}', 'ACOES': 'a#b'}, setor)
+            else:
+                setor, key = deletes[i]
+                ok = data_loader.delete_rotina(setor, key)
+            latencies.append(time.perf_counter() - start)
+            failures += 0 if ok else 1
+        return {'failures': failures, **_latency_stats(latencies)}
+
+    for operation in ('update', 'append', 'delete'):
+        phase(operation, lambda operation=operation: crud(operation), operations=args.crud_ops)
+
+    # 6. Gravação da fila: edições, exclusões e inclusões consolidadas em poucas chamadas por aba
+    def flush():
+        outcomes = [outcome for results in data_loader.flush_pending_writes().values() for _, outcome, _ in results]
+        return {'written': outcomes.count('ok'), 'not_written': len(outcomes) - outcomes.count('ok')}
+    phase('flush', flush, operations=args.crud_ops * 3)
+    wait_for_refresh()
+
+    for result in results:
+        result['quota_errors_injected'] = backend.quota_errors
+    return results
+
+# --- Comparação com Execução Anterior ---
+
+def compare(results: list, baseline_path: str, max_regression: float) -> bool:
+    """Imprime a razão atual/anterior do tempo e das chamadas por (tamanho, fase). Retorna False se
+    alguma fase ficou mais lenta que max_regression."""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {(item['size'], item['phase']): item for item in json.load(f)['results']}
+
+    ok = True
+    print(f"{'tamanho':>8} {'fase':<18} {'tempo':>8} {'chamadas':>9}")
+    for result in results:
+        previous = baseline.get((result['size'], result['phase']))
+        if previous is None:
+            continue
+        ratio = result['wall_seconds'] / previous['wall_seconds'] if previous['wall_seconds'] else 1.0
+        calls = f"{previous['api_calls']}→{result['api_calls']}"
+        flag = ''
+        if max_regression is not None and ratio > max_regression:
+            ok, flag = False, '  REGRESSÃO'
+        print(f"{result['size']:>8} {result['phase']:<18} {ratio:>7.2f}x {calls:>9}{flag}")
+    return ok
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)), help='Quantidades de rotinas (separadas por vírgula)')
+    parser.add_argument('--latency', type=float, default=0.0, help='Latência por chamada à API simulada (segundos)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Variação aleatória máxima da latência (segundos)')
+    parser.add_argument('--quota-error-rate', type=float, default=0.0, help='Probabilidade de erro 429 por chamada')
+    parser.add_argument('--quota-per-minute', type=int, default=None, help='Limite de chamadas por minuto (429 acima dele)')
+    parser.add_argument('--crud-ops', type=int, default=5, help='Operações de update/append/delete por tamanho')
+    parser.add_argument('--repeat', type=int, default=5, help='Repetições do conjunto de buscas')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help='Desliga o tracemalloc (tempos mais próximos do real)')
+    parser.add_argument('--output', help='Arquivo JSON de saída (padrão: stdout)')
+    parser.add_argument('--baseline', help='JSON de uma execução anterior para comparação')
+    parser.add_argument('--max-regression', type=float, default=None, help='Razão de tempo máxima aceita em relação ao baseline')
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(message)s', stream=sys.stderr)
+    for name in ('data_loader', 'streamlit'):
+        logging.getLogger(name).setLevel(logging.ERROR)
+
+    if args.memory:
+        tracemalloc.start()
+
+    results = []
+    for size in (int(value) for value in args.sizes.split(',') if value.strip()):
+        results.extend(run_size(size, args))
+
+    report = {
+        'meta': {
+            'timestamp': pd.Timestamp.now().isoformat(),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'latency': args.latency,
+            'jitter': args.jitter,
+            'quota_error_rate': args.quota_error_rate,
+            'quota_per_minute': args.quota_per_minute,
+            'tracemalloc': args.memory,
+        },
+        'results': results,
+    }
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.baseline:
+        return 0 if compare(results, args.baseline, args.max_regression) else 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
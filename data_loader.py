@@ -1,9 +1,28 @@
 # data_loader.py
+import atexit
+import hashlib
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import Counter
+
 import streamlit as st
 import pandas as pd
 import gspread
 import gspread.utils
 
+from rotinas_dataset import ROW_NUMBER_COLUMN, RotinasDataset
+from search_index import SearchIndex
+from snapshot_store import load_snapshot, save_snapshot
+from telemetry import TELEMETRY
+from write_queue import DEFAULT_FLUSH_DELAY, PENDING, Mutation, WriteQueue
+
+logger = logging.getLogger(__name__)
+
 # --- Configurações de Governança ---
 
 SHEET_NAMES = [
@@ -21,145 +40,1119 @@ SHEET_NAMES = [
 
 try:
     SPREADSHEET_ID = st.secrets["spreadsheet_ids"]["rotinas_hospitalares"] 
-except KeyError:
+except (KeyError, FileNotFoundError):
+    # Sem secrets.toml (ex.: benchmarks com planilha simulada) o módulo ainda pode ser importado
     SPREADSHEET_ID = None
 
-# --- Função Principal de Carga de Dados (Read) ---
+# Intervalo da verificação periódica de mudanças na planilha (segundos); 0 desativa
+POLL_INTERVAL_SECONDS = int(os.environ.get('SGC_POLL_INTERVAL_SECONDS', '0'))
 
-@st.cache_data 
-def load_all_rotinas_from_drive():
-    """Carrega dados de todas as abas da Planilha Google, garantindo colunas consistentes."""
-    all_data = []
-    
-    try:
-        if not SPREADSHEET_ID:
-            raise KeyError("ID da planilha 'rotinas_hospitalares' não encontrado nos secrets.")
-            
+# Snapshot local do último conjunto de dados válido (warm start após reinício/deploy)
+SNAPSHOT_PATH = os.environ.get('SGC_SNAPSHOT_PATH', os.path.join('.cache', 'rotinas_snapshot.sqlite'))
+
+# Espera para juntar gravações seguidas do snapshot em uma só e limite da gravação na saída (segundos)
+SNAPSHOT_SAVE_DELAY = float(os.environ.get('SGC_SNAPSHOT_SAVE_DELAY_SECONDS', '5'))
+SNAPSHOT_FLUSH_TIMEOUT = 30
+
+# Diário da fila de gravações no Sheets e espera para juntar edições em sequência (segundos)
+WRITE_QUEUE_PATH = os.environ.get('SGC_WRITE_QUEUE_PATH', os.path.join('.cache', 'write_queue.sqlite'))
+WRITE_FLUSH_DELAY = float(os.environ.get('SGC_WRITE_FLUSH_DELAY_SECONDS', str(DEFAULT_FLUSH_DELAY)))
+
+# --- Contagem de Chamadas à API do Sheets ---
+
+# Contador por processo das chamadas HTTP feitas ao Google Sheets (por operação).
+API_CALL_COUNTS = Counter()
+
+# Cota de requisições do Sheets por minuto por usuário (a Service Account conta como um usuário)
+SHEETS_QUOTA_PER_MINUTE = int(os.environ.get('SGC_SHEETS_QUOTA_PER_MINUTE', '60'))
+
+
+# Retentativas para erros de cota (429) e instabilidade do Google (5xx)
+RETRY_MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 1.0   # segundos
+RETRY_MAX_DELAY = 32.0   # segundos
+
+
+def _is_retryable(error: Exception, idempotent: bool) -> bool:
+    """429 é sempre seguro repetir; 5xx apenas em operações idempotentes (a escrita pode ter sido aplicada)."""
+    if not isinstance(error, gspread.exceptions.APIError):
+        return False
+    if error.code == 429:
+        return True
+    return idempotent and 500 <= error.code < 600
+
+
+def _api_call(operation: str, func, *args, idempotent: bool = True, **kwargs):
+    """Executa uma chamada ao Google Sheets registrando-a no contador de chamadas e repetindo
+    erros de cota/servidor com backoff exponencial e jitter."""
+    for attempt in range(RETRY_MAX_ATTEMPTS):
+        API_CALL_COUNTS[operation] += 1
+        TELEMETRY.mark('sheets.call')
+        try:
+            with TELEMETRY.span(f"sheets.{operation}", attempt=attempt + 1):
+                return func(*args, **kwargs)
+        except gspread.exceptions.APIError as e:
+            TELEMETRY.increment(f"sheets.erro_{e.code}")
+            if attempt == RETRY_MAX_ATTEMPTS - 1 or not _is_retryable(e, idempotent):
+                raise
+            delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt) + random.uniform(0, 1)
+            logger.info("Sheets %s retornou %s; nova tentativa em %.1fs", operation, e.code, delay)
+            time.sleep(delay)
+
+
+def get_api_call_total() -> int:
+    """Retorna o total de chamadas ao Google Sheets feitas por este processo."""
+    return sum(API_CALL_COUNTS.values())
+
+def describe_api_error(error: gspread.exceptions.APIError) -> str:
+    """Mensagem amigável para erros da API do Sheets (o detalhe bruto vai para o log)."""
+    logger.warning("Erro da API do Google Sheets: %s", error)
+    if error.code == 429:
+        return "Limite de requisições do Google Sheets atingido. Aguarde alguns instantes e tente novamente."
+    if 500 <= error.code < 600:
+        return "O Google Sheets está temporariamente indisponível. Tente novamente em instantes."
+    if error.code in (401, 403):
+        return "ERRO DE PERMISSÃO: a Service Account precisa ser Editor da planilha."
+    return f"Erro na API do Google Sheets (código {error.code})."
+
+# --- Conexão Compartilhada com o Google Sheets ---
+
+class _SheetsConnection:
+    """Cliente autenticado, planilha e abas reutilizados por leituras e escritas.
+
+    O token OAuth é renovado automaticamente pelo google-auth apenas quando expira."""
+
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+        self.lock = threading.Lock()
+        self._worksheets = None
+
+    def worksheet(self, name: str):
+        """Retorna a aba pelo nome, buscando os metadados de todas as abas uma única vez."""
+        with self.lock:
+            if self._worksheets is None or name not in self._worksheets:
+                worksheets = _api_call('worksheets', self.spreadsheet.worksheets)
+                self._worksheets = {ws.title: ws for ws in worksheets}
+            worksheet = self._worksheets.get(name)
+
+        if worksheet is None:
+            raise gspread.exceptions.WorksheetNotFound(name)
+        return worksheet
+
+
+@st.cache_resource
+def _get_connection() -> _SheetsConnection:
+    """Conexão única por processo: autentica e abre a planilha apenas na primeira chamada."""
+    if not SPREADSHEET_ID:
+        raise KeyError("ID da planilha 'rotinas_hospitalares' não encontrado nos secrets.")
+
+    with TELEMETRY.span('sheets.auth'):
         gc = gspread.service_account_from_dict(st.secrets["gcp_service_account"])
-        sh = gc.open_by_key(SPREADSHEET_ID)
-        
-        for name in SHEET_NAMES:
-            worksheet = sh.worksheet(name)
-            data = worksheet.get_all_records()
-            df = pd.DataFrame(data)
-            
-            df['SETOR'] = name
-            
-            # Garante que a coluna de imagem existe no DataFrame lido
-            if 'URL_IMAGEM' not in df.columns:
-                df['URL_IMAGEM'] = '' 
-            
-            all_data.append(df)
-
-        df_final = pd.concat(all_data, ignore_index=True)
-        return df_final
-
-    except KeyError as e:
-        st.error(f"ERRO DE CONFIGURAÇÃO: Chave {e} faltando. Verifique secrets.toml ou as chaves.")
-        return pd.DataFrame()
+    sh = _api_call('open_by_key', gc.open_by_key, SPREADSHEET_ID)
+    return _SheetsConnection(sh)
+
+
+def _reset_connection():
+    """Descarta a conexão em cache (credenciais revogadas, abas renomeadas etc.)."""
+    _get_connection.clear()
+
+
+def _handle_connection_error(error: Exception):
+    """Força uma nova conexão na próxima chamada quando o erro indica handles inválidos."""
+    if isinstance(error, gspread.exceptions.WorksheetNotFound):
+        _reset_connection()
+    elif isinstance(error, gspread.exceptions.APIError) and error.code in (401, 404):
+        _reset_connection()
+
+# --- Conversão dos Valores em Lote para DataFrame ---
+
+def _values_to_dataframe(values: list, sheet_name: str) -> pd.DataFrame:
+    """Converte a matriz de valores de uma aba no mesmo DataFrame gerado por get_all_records()."""
+    if not values or values == [[]]:
+        df = pd.DataFrame()
+    else:
+        headers = values[0]
+        rows = gspread.utils.fill_gaps(values[1:], cols=len(headers)) if len(values) > 1 else []
+        records = gspread.utils.to_records(headers, [gspread.utils.numericise_all(row) for row in rows])
+        df = pd.DataFrame(records, columns=headers)
+
+    df['SETOR'] = sheet_name
+    df[ROW_NUMBER_COLUMN] = range(2, len(df) + 2)
+
+    # Garante que a coluna de imagem existe no DataFrame lido
+    if 'URL_IMAGEM' not in df.columns:
+        df['URL_IMAGEM'] = ''
+
+    return df
+
+
+def fetch_tab_values(sh) -> dict:
+    """Lê a matriz de valores de todas as abas de SHEET_NAMES com uma única chamada values_batch_get."""
+    ranges = [gspread.utils.absolute_range_name(name) for name in SHEET_NAMES]
+    response = _api_call('values_batch_get', sh.values_batch_get, ranges)
+    value_ranges = response.get('valueRanges', [])
+
+    # A API devolve os intervalos na mesma ordem em que foram pedidos
+    return {name: value_range.get('values', []) for name, value_range in zip(SHEET_NAMES, value_ranges)}
+
+
+def _headers_from_values(tab_values: dict) -> dict:
+    """Cabeçalhos (linha 1) de cada aba."""
+    return {name: list(values[0]) if values else [] for name, values in tab_values.items()}
+
+
+# --- Detecção de Mudanças na Planilha ---
+
+def _tab_fingerprint(values: list) -> str:
+    """Hash do conteúdo de uma aba, para saber se ela mudou desde a última carga."""
+    return hashlib.sha1(json.dumps(values, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def _probe_remote_modified(cache, sh):
+    """Horário da última modificação da planilha no Drive (uma chamada leve, sem baixar as abas).
+
+    Retorna None se a sonda não estiver disponível (ex.: Drive API desativada para a Service Account)."""
+    if not cache.probe_supported:
+        return None
+    try:
+        return _api_call('get_lastUpdateTime', sh.get_lastUpdateTime)
     except gspread.exceptions.APIError as e:
-        st.error(f"ERRO DE PERMISSÃO: Service Account precisa ser Editor. Detalhes: {e}")
-        return pd.DataFrame()
+        if e.code in (403, 404):
+            cache.probe_supported = False
+        logger.info("Sonda de modificação indisponível (%s); usando carga completa.", e.code)
+        return None
+
+# --- Normalização dos Dados Carregados ---
+
+# Colunas que toda aba deve ter
+REQUIRED_COLUMNS = ['ID_DA_ROTINA', 'TITULO_PROCEDIMENTO', 'FLUXO_PRINCIPAL', 'ACOES', 'OBSERVACOES', 'URL_IMAGEM']
+
+# Colunas de texto livre (números ou outros tipos nelas indicam célula mal preenchida)
+TEXT_COLUMNS = ['TITULO_PROCEDIMENTO', 'FLUXO_PRINCIPAL', 'ACOES', 'OBSERVACOES', 'URL_IMAGEM']
+
+# Colunas calculadas na carga; não existem na planilha e não vão para o snapshot
+DERIVED_COLUMNS = ['PASSOS', 'ACOES_TEXTO', 'ANEXOS', 'ANEXOS_TIPOS']
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+DOCUMENT_EXTENSIONS = ('.pdf', '.doc', '.docx')
+
+
+def _split_column(values: pd.Series, separator: str) -> pd.Series:
+    """Quebra cada célula pelo separador em uma lista de itens não vazios (sem espaços nas pontas)."""
+    parts = values.str.split(separator).explode().str.strip()
+    parts = parts[parts != '']
+    lists = parts.groupby(level=0).agg(list).reindex(values.index)
+    return lists.map(lambda items: items if isinstance(items, list) else [])
+
+
+def _classify_attachments(urls: pd.Series) -> pd.Series:
+    """Classifica cada URL (sem query string) em 'imagem', 'documento' ou 'link'."""
+    clean = urls.str.split('?').str[0].str.lower()
+    kinds = pd.Series('link', index=urls.index, dtype=object)
+    kinds[clean.str.endswith(DOCUMENT_EXTENSIONS)] = 'documento'
+    kinds[clean.str.endswith(IMAGE_EXTENSIONS)] = 'imagem'
+    return kinds
+
+
+def _text_column(df: pd.DataFrame, column: str) -> pd.Series:
+    """Coluna como texto ('' para células vazias ou coluna ausente)."""
+    if column not in df.columns:
+        return pd.Series('', index=df.index, dtype=object)
+    return df[column].fillna('').astype(str)
+
+
+def add_derived_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Pré-processa ACOES e URL_IMAGEM uma única vez: lista de passos, texto para edição,
+    lista de anexos e o tipo de cada anexo."""
+    df = df.drop(columns=[col for col in DERIVED_COLUMNS if col in df.columns])
+    acoes = _text_column(df, 'ACOES')
+    urls = _text_column(df, 'URL_IMAGEM')
+
+    anexos = _split_column(urls, ',')
+    flat_urls = anexos.explode().dropna()
+    kinds = _classify_attachments(flat_urls.astype(str)).groupby(level=0).agg(list).reindex(df.index)
+
+    return df.assign(
+        PASSOS=_split_column(acoes, '#'),
+        ACOES_TEXTO=acoes.str.replace('#', '\n', regex=False),
+        ANEXOS=anexos,
+        ANEXOS_TIPOS=kinds.map(lambda items: items if isinstance(items, list) else []),
+    )
+
+
+VALIDATION_COLUMNS = ['SETOR', 'COLUNA', 'PROBLEMA', 'LINHAS']
+
+
+def validate_tab(df: pd.DataFrame, sheet_name: str, sheet_headers: list) -> list:
+    """Problemas de esquema de uma aba, a partir dos valores brutos (antes da conversão para texto):
+    colunas ausentes, células não textuais e rotinas sem título ou sem ações."""
+    sheet_headers = [header.strip() for header in sheet_headers]
+    if not sheet_headers:
+        return [{'SETOR': sheet_name, 'COLUNA': '—', 'PROBLEMA': 'Aba vazia ou sem cabeçalho', 'LINHAS': 0}]
+
+    issues = []
+    for column in REQUIRED_COLUMNS:
+        if column not in sheet_headers:
+            issues.append({'SETOR': sheet_name, 'COLUNA': column, 'PROBLEMA': 'Coluna ausente', 'LINHAS': 0})
+
+    if not df.empty:
+        for column in TEXT_COLUMNS:
+            if column not in df.columns:
+                continue
+            values = df[column]
+            count = int((values.notna() & ~values.map(lambda value: isinstance(value, str))).sum())
+            if count:
+                issues.append({'SETOR': sheet_name, 'COLUNA': column, 'PROBLEMA': 'Células não textuais (número/data)', 'LINHAS': count})
+
+        for column, problem in (('TITULO_PROCEDIMENTO', 'Rotina sem título'), ('ACOES', 'Rotina sem ações/passos')):
+            count = int((_text_column(df, column).str.strip() == '').sum())
+            if count:
+                issues.append({'SETOR': sheet_name, 'COLUNA': column, 'PROBLEMA': problem, 'LINHAS': count})
+
+    return issues
+
+
+def _validation_report(issues_by_tab: dict) -> pd.DataFrame:
+    """Relatório de validação a partir dos problemas guardados por aba."""
+    issues = [issue for sheet_name in SHEET_NAMES for issue in issues_by_tab.get(sheet_name, [])]
+    return pd.DataFrame(issues, columns=VALIDATION_COLUMNS)
+
+
+def build_partition(values: list, sheet_name: str) -> tuple:
+    """Converte os valores de uma aba na sua partição normalizada. Retorna (DataFrame, problemas de esquema)."""
+    raw_df = _values_to_dataframe(values, sheet_name)
+    headers = list(values[0]) if values else []
+    return add_derived_columns(raw_df), validate_tab(raw_df, sheet_name, headers)
+
+# --- Cache Compartilhado do Conjunto de Dados (Stale-While-Revalidate) ---
+
+class _DatasetCache:
+    """Último conjunto de dados válido, compartilhado por todas as sessões do processo."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Sinaliza o fim da busca em andamento para quem está aguardando (single-flight)
+        self.reload_done = threading.Condition(self.lock)
+        self.dataset = None
+        self.version = 0
+        self.loaded_at = None
+        self.source = None
+        self.refreshing = False
+        self.last_error = None
+        self.last_exception = None
+        self.last_forced_refresh_at = 0.0
+        self.reload_stats = Counter()
+        # Detecção de mudanças: horário de modificação no Drive e hash de cada aba na última carga
+        self.probe_supported = True
+        self.remote_modified_at = None
+        self.tab_fingerprints = {}
+        self.checked_at = None
+        self.headers = {}
+        # Problemas de esquema por aba, validados na carga dos valores brutos de cada aba
+        self.validation_issues = {}
+        self.validation_report = None
+        # Estruturas derivadas do conjunto (índice de busca, localizador de linhas), por versão
+        self.derived = {}
+        # Serializa as escritas (registro na fila + write-through): a ordem no diário é a do cache,
+        # e a linha registrada em cada mutação já considera as anteriores
+        self.write_lock = threading.Lock()
+
+
+@st.cache_resource
+def _get_dataset_cache() -> _DatasetCache:
+    """Instância única do cache de dados, criada na primeira execução do processo."""
+    return _DatasetCache()
+
+
+def _fetch_changes(cache: _DatasetCache, force: bool = False):
+    """Busca no Sheets apenas o que mudou desde a última carga. Propaga exceções para o chamador.
+
+    Primeiro consulta o horário de modificação da planilha no Drive; se não mudou, nenhuma aba é
+    baixada. Caso contrário, baixa as abas em lote e reconstrói somente as partições das abas com
+    hash diferente, reaproveitando as demais. Com force=True (pedido explícito do usuário) todas as
+    abas são reconstruídas, corrigindo um cache que tenha divergido da planilha. As mutações ainda na
+    fila de gravação são reaplicadas sobre as abas reconstruídas. Retorna None se nada mudou ou
+    (RotinasDataset, cabeçalhos, estado da detecção)."""
+    try:
+        sh = _get_connection().spreadsheet
+        modified = _probe_remote_modified(cache, sh)
+        with cache.lock:
+            current = cache.dataset
+            known_fingerprints = dict(cache.tab_fingerprints)
+            known_modified = cache.remote_modified_at
+            issues = dict(cache.validation_issues)
+
+        if not force and current is not None and modified is not None and modified == known_modified:
+            _mark_checked(cache, modified)
+            return None
+
+        # A planilha e a fila são lidas sem gravação em andamento: cada mutação do diário está ou
+        # não está nos valores lidos, nunca pela metade
+        queue = _get_write_queue()
+        with queue.hold_flushes():
+            tab_values = fetch_tab_values(sh)
+            queued = queue.mutations()
+        fingerprints = {name: _tab_fingerprint(values) for name, values in tab_values.items()}
+        changed = [name for name in SHEET_NAMES
+                   if force or current is None or fingerprints[name] != known_fingerprints.get(name)]
+        if not changed:
+            _mark_checked(cache, modified, fingerprints)
+            return None
+
+        partitions = {}
+        with TELEMETRY.span('load.normalize', tabs=len(changed)):
+            for name in changed:
+                partitions[name], issues[name] = build_partition(tab_values[name], name)
+        logger.info("Abas recarregadas do Sheets: %s", ', '.join(changed))
+
+        base = current if current is not None else RotinasDataset.from_partitions({}, SHEET_NAMES)
+        state = {'remote_modified_at': modified, 'tab_fingerprints': fingerprints, 'validation': issues}
+        headers = _headers_from_values(tab_values)
+        with TELEMETRY.span('load.compact', tabs=len(changed)):
+            dataset = base.replace_partitions(partitions)
+        replay = [mutation for mutation in queued if mutation.sheet in partitions]
+        if replay:
+            dataset, missing = _apply_mutations(dataset, replay, headers)
+            if missing:
+                logger.info("%d mutação(ões) da fila sem rotina correspondente na planilha.", len(missing))
+        return dataset, headers, state
     except Exception as e:
-        st.error(f"Erro Inesperado na carga de dados: {e}")
-        return pd.DataFrame()
+        _handle_connection_error(e)
+        raise
+
+
+def _mark_checked(cache: _DatasetCache, modified: str, fingerprints: dict = None):
+    """Registra que a planilha foi verificada e continua igual aos dados em cache."""
+    with cache.lock:
+        cache.checked_at = pd.Timestamp.now()
+        cache.reload_stats['probes_unchanged'] += 1
+        if modified is not None:
+            cache.remote_modified_at = modified
+        if fingerprints is not None:
+            cache.tab_fingerprints = fingerprints
+
+
+def _save_snapshot(dataset: RotinasDataset, headers: dict, version: int, loaded_at: pd.Timestamp, state: dict):
+    """Grava o snapshot local sem interromper o fluxo em caso de falha de disco."""
+    try:
+        with TELEMETRY.span('snapshot.save', version=version):
+            df = dataset.to_frame()
+            raw_df = df.drop(columns=[col for col in DERIVED_COLUMNS if col in df.columns])
+            save_snapshot(SNAPSHOT_PATH, raw_df, headers, version, loaded_at, state)
+    except Exception as e:
+        logger.warning("Falha ao gravar snapshot local em %s: %s", SNAPSHOT_PATH, e)
+
+
+class _SnapshotWriter:
+    """Thread única que grava o snapshot fora do caminho das requisições.
+
+    Pedidos feitos enquanto ela espera ou grava substituem o pendente: só a versão mais nova vai
+    para o disco, e como há um único gravador uma versão antiga nunca sobrescreve uma mais nova.
+    A espera de SNAPSHOT_SAVE_DELAY segundos junta várias edições seguidas em uma só gravação."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.condition = threading.Condition()
+        self.pending = None
+        self.written_version = None
+        self.saving = False
+        self.flush_requested = False
+        self._thread = None
+
+    def submit(self, dataset: RotinasDataset, headers: dict, version: int, loaded_at: pd.Timestamp, state: dict):
+        with self.condition:
+            known = [self.written_version, self.pending[2] if self.pending else None]
+            if any(other is not None and version <= other for other in known):
+                return
+            self.pending = (dataset, dict(headers), version, loaded_at, state)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='sgc-snapshot', daemon=True)
+                self._thread.start()
+            self.condition.notify_all()
+
+    def flush(self, timeout: float = None) -> bool:
+        """Grava já o snapshot pendente e aguarda. Retorna False se o tempo acabar antes."""
+        with self.condition:
+            self.flush_requested = True
+            self.condition.notify_all()
+            done = self.condition.wait_for(lambda: self.pending is None and not self.saving, timeout=timeout)
+            self.flush_requested = False
+            return done
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending is not None)
+                deadline = time.monotonic() + self.delay
+                self.condition.wait_for(lambda: self.flush_requested or time.monotonic() >= deadline,
+                                        timeout=self.delay)
+                dataset, headers, version, loaded_at, state = self.pending
+                self.pending = None
+                self.saving = True
+            try:
+                _save_snapshot(dataset, headers, version, loaded_at, state)
+            finally:
+                with self.condition:
+                    self.saving = False
+                    self.written_version = version
+                    self.condition.notify_all()
+
+
+@st.cache_resource
+def _get_snapshot_writer() -> _SnapshotWriter:
+    """Gravador único por processo; o snapshot pendente é gravado também na saída do processo."""
+    writer = _SnapshotWriter(SNAPSHOT_SAVE_DELAY)
+    atexit.register(writer.flush, SNAPSHOT_FLUSH_TIMEOUT)
+    return writer
+
+
+def _store_dataset(cache: _DatasetCache, dataset: RotinasDataset, headers: dict, source: str, loaded_at: pd.Timestamp,
+                   version: int = None, expected_version: int = None, state: dict = None) -> bool:
+    """Publica um novo conjunto de dados no cache e, se veio do Sheets, atualiza o snapshot em disco.
+
+    Com expected_version, não publica se o cache mudou desde o início da busca (ex.: write-through).
+    state traz o horário de modificação e os hashes das abas usados na detecção de mudanças, além
+    dos problemas de esquema de cada aba."""
+    state = state or {}
+    issues = dict(state.get('validation') or {})
+    report = _validation_report(issues)
+
+    with cache.lock:
+        if expected_version is not None and cache.version != expected_version:
+            return False
+        cache.dataset = dataset
+        cache.headers = dict(headers)
+        cache.validation_issues = issues
+        cache.validation_report = report
+        cache.remote_modified_at = state.get('remote_modified_at')
+        cache.tab_fingerprints = dict(state.get('tab_fingerprints') or {})
+        cache.checked_at = loaded_at
+        cache.version = version if version is not None else cache.version + 1
+        cache.loaded_at = loaded_at
+        cache.source = source
+        cache.last_error = None
+        version = cache.version
+
+    if source == 'sheets':
+        _get_snapshot_writer().submit(dataset, headers, version, loaded_at, state)
+    return True
+
+
+# --- Coordenação das Recargas (Single-Flight) ---
+
+# Quantas vezes a recarga refaz a busca se houver escritas (write-through) durante ela
+BACKGROUND_REFRESH_MAX_ATTEMPTS = 3
+
+# Intervalo mínimo entre recargas forçadas pelo botão "Atualizar Dados Agora" (segundos)
+MIN_FORCED_REFRESH_INTERVAL = 30
+
+# Tempo máximo que uma sessão espera pela busca em andamento de outra sessão (segundos)
+RELOAD_WAIT_TIMEOUT = 120
+
+
+def _run_reload(cache: _DatasetCache, force: bool = False):
+    """Executa a busca no Sheets e publica o resultado. Sempre libera quem aguarda, mesmo com erro."""
+    error = None
+    try:
+        for attempt in range(BACKGROUND_REFRESH_MAX_ATTEMPTS):
+            started_version = cache.version
+            with TELEMETRY.span('load.fetch', force=force):
+                changes = _fetch_changes(cache, force=force)
+            if changes is None:
+                break
+            dataset, headers, state = changes
+            # Uma escrita aplicada durante a busca pode não estar nos dados lidos: busca de novo
+            last_attempt = attempt == BACKGROUND_REFRESH_MAX_ATTEMPTS - 1
+            expected = None if last_attempt else started_version
+            if _store_dataset(cache, dataset, headers, 'sheets', pd.Timestamp.now(), expected_version=expected, state=state):
+                break
+    except Exception as e:
+        error = e
+        logger.warning("Falha ao recarregar os dados do Sheets: %s", e)
+    finally:
+        with cache.lock:
+            cache.refreshing = False
+            cache.last_exception = error
+            cache.last_error = str(error) if error else None
+            cache.reload_done.notify_all()
+    return error
+
+
+def _reload(cache: _DatasetCache, wait: bool, force: bool = False) -> str:
+    """Inicia (ou reaproveita) a recarga dos dados, garantindo no máximo uma busca por vez no processo.
+
+    Quem chega com uma busca em andamento não dispara outra: com wait=True aguarda o resultado dela,
+    com wait=False segue com a versão atual. Retorna 'started', 'coalesced' ou 'throttled'."""
+    with cache.lock:
+        if force and cache.dataset is not None and time.time() - cache.last_forced_refresh_at < MIN_FORCED_REFRESH_INTERVAL:
+            cache.reload_stats['forced_refreshes_throttled'] += 1
+            return 'throttled'
+
+        if cache.refreshing:
+            cache.reload_stats['fetches_coalesced'] += 1
+            if wait:
+                cache.reload_done.wait_for(lambda: not cache.refreshing, timeout=RELOAD_WAIT_TIMEOUT)
+            return 'coalesced'
+
+        cache.refreshing = True
+        cache.reload_stats['fetches_started'] += 1
+        if force:
+            cache.last_forced_refresh_at = time.time()
+
+    if wait:
+        _run_reload(cache, force)
+    else:
+        threading.Thread(target=_run_reload, args=(cache, force), name='sgc-refresh', daemon=True).start()
+    return 'started'
+
+
+def _start_background_refresh(cache: _DatasetCache):
+    """Dispara a recarga em segundo plano, se nenhuma estiver em andamento."""
+    _reload(cache, wait=False)
+
+
+@st.cache_resource
+def _start_poller(interval: int) -> threading.Thread:
+    """Thread única por processo que verifica mudanças na planilha a cada `interval` segundos."""
+    cache = _get_dataset_cache()
+
+    def poll():
+        while True:
+            time.sleep(interval)
+            try:
+                _reload(cache, wait=True)
+            except Exception as e:
+                logger.warning("Falha na verificação periódica da planilha: %s", e)
+
+    thread = threading.Thread(target=poll, name='sgc-poller', daemon=True)
+    thread.start()
+    return thread
+
+
+def get_reload_stats() -> dict:
+    """Contadores do processo: buscas iniciadas, chamadas reaproveitadas, recargas forçadas barradas e
+    verificações que dispensaram o download por não haver mudanças."""
+    cache = _get_dataset_cache()
+    with cache.lock:
+        stats = {key: cache.reload_stats[key] for key in ('fetches_started', 'fetches_coalesced', 'forced_refreshes_throttled', 'probes_unchanged')}
+        stats['in_flight'] = cache.refreshing
+    return stats
+
+
+def _load_snapshot_into(cache: _DatasetCache) -> bool:
+    """Carrega o snapshot em disco no cache. Retorna False se não houver snapshot utilizável."""
+    try:
+        with TELEMETRY.span('snapshot.load'):
+            snapshot = load_snapshot(SNAPSHOT_PATH)
+    except Exception as e:
+        logger.warning("Snapshot local ilegível em %s: %s", SNAPSHOT_PATH, e)
+        return False
+
+    if snapshot is None:
+        return False
+
+    # O snapshot guarda apenas as colunas da planilha: as derivadas são recalculadas por aba
+    df = snapshot.df
+    partitions = {name: add_derived_columns(df[df['SETOR'] == name]) for name in SHEET_NAMES}
+    dataset = RotinasDataset.from_partitions(partitions, SHEET_NAMES)
+    _store_dataset(cache, dataset, snapshot.headers, 'snapshot', snapshot.loaded_at, version=snapshot.version, state=snapshot.state)
+    return True
+
+# --- Função Principal de Carga de Dados (Read) ---
+
+def load_all_rotinas_from_drive() -> RotinasDataset:
+    """Retorna as rotinas de todas as abas, particionadas por setor. Na primeira chamada do processo
+    serve o snapshot local (se existir) e revalida com o Google Sheets em segundo plano. Com
+    SGC_POLL_INTERVAL_SECONDS > 0, uma verificação periódica mantém o cache atualizado."""
+    cache = _get_dataset_cache()
+    if POLL_INTERVAL_SECONDS > 0:
+        _start_poller(POLL_INTERVAL_SECONDS)
+
+    if cache.dataset is not None:
+        TELEMETRY.increment('dataset.cache_hit')
+        return cache.dataset
+
+    TELEMETRY.increment('dataset.cache_miss')
+    if _load_snapshot_into(cache):
+        _start_background_refresh(cache)
+        return cache.dataset
+
+    return refresh_rotinas(wait=True)
+
+
+def refresh_rotinas(wait: bool = False, force: bool = False) -> RotinasDataset:
+    """Recarrega os dados do Sheets (uma busca por vez no processo). Com wait=False a busca roda em
+    segundo plano e os dados atuais continuam sendo servidos; com wait=True a chamada bloqueia e exibe
+    erros na tela. force=True indica um pedido explícito do usuário, limitado a um a cada
+    MIN_FORCED_REFRESH_INTERVAL segundos."""
+    cache = _get_dataset_cache()
+    _reload(cache, wait=wait, force=force)
+
+    if wait and cache.last_exception is not None:
+        _show_load_error(cache.last_exception)
+
+    # Em caso de falha, mantém os últimos dados válidos (se houver)
+    return cache.dataset if cache.dataset is not None else RotinasDataset.from_partitions({}, SHEET_NAMES)
+
+
+def _show_load_error(error: Exception):
+    """Exibe na tela o erro da última tentativa de carga."""
+    if isinstance(error, KeyError):
+        st.error(f"ERRO DE CONFIGURAÇÃO: Chave {error} faltando. Verifique secrets.toml ou as chaves.")
+    elif isinstance(error, gspread.exceptions.APIError):
+        st.error(describe_api_error(error))
+    else:
+        st.error(f"Erro Inesperado na carga de dados: {error}")
+
+
+def _get_derived(name: str, build):
+    """Estrutura derivada da versão atual dos dados (e o conjunto de origem), reconstruída apenas
+    quando a versão muda."""
+    cache = _get_dataset_cache()
+    with cache.lock:
+        dataset, version = cache.dataset, cache.version
+        entry = cache.derived.get(name)
+        if entry is not None and entry[0] == version:
+            TELEMETRY.increment(f"{name}.cache_hit")
+            return entry[1], dataset
+
+    TELEMETRY.increment(f"{name}.cache_miss")
+    if dataset is None:
+        dataset = RotinasDataset.from_partitions({}, SHEET_NAMES)
+
+    # A construção roda fora do lock para não bloquear outras sessões
+    with TELEMETRY.span(f"build.{name}", version=version):
+        value = build(dataset)
+    with cache.lock:
+        if cache.version == version:
+            cache.derived[name] = (version, value)
+    return value, dataset
+
+
+def _get_search_index():
+    """Índice de busca da versão atual dos dados e o conjunto de origem."""
+    return _get_derived('search_index', lambda dataset: SearchIndex(dataset.to_frame()))
+
+
+def search_rotinas(query: str, setor: str = None) -> pd.DataFrame:
+    """Busca por relevância (sem acentos/caixa, com prefixo) em um setor ou em todos (setor=None)."""
+    index, dataset = _get_search_index()
+    with TELEMETRY.span('search', setor=setor):
+        return dataset.to_frame().loc[index.search(query, setor=setor)]
+
+
+def get_validation_report() -> pd.DataFrame:
+    """Problemas de esquema encontrados na última carga (vazio se estiver tudo certo)."""
+    report = _get_dataset_cache().validation_report
+    return report if report is not None else pd.DataFrame(columns=['SETOR', 'COLUNA', 'PROBLEMA', 'LINHAS'])
+
+
+def get_api_calls_per_minute() -> int:
+    """Chamadas ao Sheets feitas por este processo no último minuto (comparar com SHEETS_QUOTA_PER_MINUTE)."""
+    return TELEMETRY.rate_per_minute('sheets.call')
+
+
+def get_dataset_status() -> dict:
+    """Metadados do conjunto de dados em uso: versão, horário real da carga, origem e atualização pendente."""
+    cache = _get_dataset_cache()
+    with cache.lock:
+        return {
+            'version': cache.version,
+            'loaded_at': cache.loaded_at,
+            'checked_at': cache.checked_at,
+            'source': cache.source,
+            'refreshing': cache.refreshing,
+            'last_error': cache.last_error,
+        }
+
+
+def get_versioned_dataset() -> tuple:
+    """(conjunto, versão, horário da carga) lidos juntos, para ETags e caches por versão dos dados."""
+    dataset = load_all_rotinas_from_drive()
+    cache = _get_dataset_cache()
+    with cache.lock:
+        if cache.dataset is not None:
+            return cache.dataset, cache.version, cache.loaded_at
+        return dataset, cache.version, cache.loaded_at
+
+# --- Atualização Write-Through do Cache ---
+
+def _locate_row(partition: pd.DataFrame, row: int, title: str):
+    """Rótulo da rotina na linha `row` da aba, conferida pelo título. Sem a linha, ou se ela não
+    conferir, vale o título quando ele é único na partição. None se a rotina não for encontrada."""
+    if partition.empty or 'TITULO_PROCEDIMENTO' not in partition.columns:
+        return None
+    same_title = partition['TITULO_PROCEDIMENTO'] == str(title)
+    if row is not None:
+        labels = partition.index[same_title & (partition[ROW_NUMBER_COLUMN] == row)]
+        if len(labels):
+            return labels[0]
+    labels = partition.index[same_title]
+    return labels[0] if len(labels) == 1 else None
+
+
+def _detection_state(cache: _DatasetCache) -> dict:
+    """Estado da detecção de mudanças e da validação, gravado junto com o snapshot."""
+    return {
+        'remote_modified_at': cache.remote_modified_at,
+        'tab_fingerprints': dict(cache.tab_fingerprints),
+        'validation': dict(cache.validation_issues),
+    }
+
+
+def _record_frame(headers: list, rows: list, sheet_name: str, first_row: int, first_label: int) -> pd.DataFrame:
+    """Linhas normalizadas (com colunas derivadas) a partir dos valores gravados na planilha."""
+    records = []
+    for offset, values in enumerate(rows):
+        record = dict(zip(headers, gspread.utils.numericise_all([str(v) for v in values])))
+        record['SETOR'] = sheet_name
+        record.setdefault('URL_IMAGEM', '')
+        record[ROW_NUMBER_COLUMN] = first_row + offset
+        records.append(record)
+    index = range(first_label, first_label + len(records))
+    return add_derived_columns(pd.DataFrame(records, index=index))
+
+
+def _apply_mutations(dataset: RotinasDataset, mutations: list, headers: dict) -> tuple:
+    """Aplica ao conjunto, em ordem, mutações da fila como ficarão na planilha: inclusões no fim da
+    aba, edições e exclusões na rotina localizada pela linha e título. Retorna (novo conjunto,
+    mutações cuja rotina não foi encontrada)."""
+    missing = []
+    # Inclusões seguidas na mesma aba entram de uma só vez (importações em lote)
+    for (sheet_name, kind), group in itertools.groupby(mutations, key=lambda m: (m.sheet, m.kind)):
+        group = list(group)
+        partition = dataset.partition(sheet_name)
+
+        if kind == 'append':
+            sheet_headers = headers.get(sheet_name) or list(REQUIRED_COLUMNS)
+            rows = [[mutation.data.get(header.strip(), '') for header in sheet_headers] for mutation in group]
+            label = dataset.next_label
+            new_rows = _record_frame(sheet_headers, rows, sheet_name, len(partition) + 2, label)
+            new_partition = pd.concat([partition, new_rows]) if len(partition) else new_rows
+            dataset = dataset.with_partition(sheet_name, new_partition, next_label=label + len(rows))
+            continue
+
+        for mutation in group:
+            label = _locate_row(partition, mutation.row, mutation.title)
+            if label is None:
+                missing.append(mutation)
+                continue
+
+            if kind == 'update':
+                current = partition.loc[label]
+                sheet_headers = headers.get(sheet_name) or list(mutation.data)
+                values = [mutation.data.get(header.strip(), current.get(header.strip(), '')) for header in sheet_headers]
+                row = _record_frame(sheet_headers, [values], sheet_name, int(current[ROW_NUMBER_COLUMN]), label)
+                # Mantém colunas que existem na partição mas não na aba (ex.: URL_IMAGEM acrescentada na carga)
+                for column in partition.columns.difference(row.columns):
+                    row[column] = current[column]
+                partition = pd.concat([partition.drop(index=label), row]).reindex(partition.index)
+            else:
+                # As linhas abaixo da excluída sobem uma posição na aba
+                deleted_row = partition.at[label, ROW_NUMBER_COLUMN]
+                partition = partition.drop(index=label)
+                below = partition[ROW_NUMBER_COLUMN] > deleted_row
+                partition.loc[below, ROW_NUMBER_COLUMN] -= 1
+        dataset = dataset.with_partition(sheet_name, partition)
+    return dataset, missing
+
+
+def _invalidate_tabs(cache: _DatasetCache, sheet_names: set):
+    """Esquece o hash das abas (e o horário de modificação da planilha) para que a próxima recarga
+    baixe a planilha e reconstrua essas partições. Chamar com cache.lock adquirido."""
+    for sheet_name in sheet_names:
+        cache.tab_fingerprints.pop(sheet_name, None)
+    cache.remote_modified_at = None
+
+
+def _apply_write_through(description: str, mutations: list):
+    """Aplica ao conjunto em cache as mutações recém-registradas na fila e incrementa a versão do
+    conjunto de dados. Se alguma rotina não for encontrada, uma recarga completa é agendada em
+    segundo plano."""
+    cache = _get_dataset_cache()
+    with cache.lock:
+        if cache.dataset is None:
+            return
+        with TELEMETRY.span('cache.write_through'):
+            dataset, missing = _apply_mutations(cache.dataset, mutations, cache.headers)
+        applied = len(missing) < len(mutations)
+        if applied:
+            cache.dataset = dataset
+            cache.version += 1
+        # As abas alteradas deixam de conferir com a planilha: a próxima recarga as reconstrói
+        _invalidate_tabs(cache, {mutation.sheet for mutation in mutations})
+        version, loaded_at, state = cache.version, cache.loaded_at, _detection_state(cache)
+
+    if applied:
+        _get_snapshot_writer().submit(dataset, cache.headers, version, loaded_at, state)
+    if missing:
+        logger.info("Cache não reconciliado após %s; recarregando do Sheets em segundo plano.", description)
+        _start_background_refresh(cache)
+
+# --- Fila de Gravação no Google Sheets ---
+
+def _get_headers(sheet_name: str, worksheet=None) -> list:
+    """Cabeçalhos da aba, lidos na carga dos dados; só consulta a API se ainda não forem conhecidos."""
+    cache = _get_dataset_cache()
+    headers = cache.headers.get(sheet_name)
+    if not headers and worksheet is not None:
+        headers = _api_call('row_values', worksheet.row_values, 1)
+        with cache.lock:
+            cache.headers[sheet_name] = headers
+    return headers or []
+
+
+def _flush_outcome(error: Exception, idempotent: bool) -> str:
+    """'retry' quando repetir a gravação é seguro (cota ou falha de uma escrita idempotente); senão 'failed'."""
+    if isinstance(error, gspread.exceptions.APIError):
+        return 'retry' if _is_retryable(error, idempotent) else 'failed'
+    return 'retry' if idempotent else 'failed'
+
+
+def _describe_flush_error(error: Exception) -> str:
+    if isinstance(error, gspread.exceptions.APIError):
+        return describe_api_error(error)
+    return str(error)
+
+
+def _flush_sheet(sheet_name: str, entries: list) -> list:
+    """Grava na aba as mutações consolidadas pela fila com o mínimo de chamadas: um batch_get que
+    confere o título nas linhas registradas (se houver edições/exclusões), um batch_update com todas
+    as edições, um batchUpdate de deleteDimension com todas as exclusões e um append_rows com todas
+    as inclusões. A coluna de títulos inteira só é lida se alguma linha não conferir (planilha
+    alterada por fora).
+
+    Retorna [(mutação, 'ok' | 'retry' | 'failed', erro)]."""
+    results = []
+    try:
+        worksheet = _get_connection().worksheet(sheet_name)
+        headers = _get_headers(sheet_name, worksheet)
+        columns = {header.strip(): position for position, header in enumerate(headers)}
+        title_col_index = columns['TITULO_PROCEDIMENTO']
+    except KeyError:
+        return [(entry, 'failed', "Coluna 'TITULO_PROCEDIMENTO' não encontrada na aba.") for entry in entries]
+    except Exception as e:
+        _handle_connection_error(e)
+        return [(entry, _flush_outcome(e, idempotent=True), _describe_flush_error(e)) for entry in entries]
+
+    updates = [entry for entry in entries if entry.kind == 'update']
+    deletes = [entry for entry in entries if entry.kind == 'delete']
+    appends = [entry for entry in entries if entry.kind == 'append']
+
+    # 1. Linha atual das rotinas alvo: a registrada na fila, se o título nela conferir; senão a
+    #    ocorrência do título mais próxima dela
+    if updates or deletes:
+        expected = [entry for entry in updates + deletes if entry.row is not None]
+        try:
+            confirmed = set()
+            if expected:
+                cells = [gspread.utils.rowcol_to_a1(entry.row, title_col_index + 1) for entry in expected]
+                found = _api_call('batch_get', worksheet.batch_get, cells)
+                confirmed = {id(entry) for entry, value in zip(expected, found)
+                             if value and value[0] and str(value[0][0]) == str(entry.target)}
+            unresolved = [entry for entry in updates + deletes if id(entry) not in confirmed]
+            titles = _api_call('col_values', worksheet.col_values, title_col_index + 1) if unresolved else []
+        except Exception as e:
+            _handle_connection_error(e)
+            outcome, message = _flush_outcome(e, idempotent=True), _describe_flush_error(e)
+            return [(entry, outcome, message) for entry in entries]
+
+        title_rows = {}
+        for row_number, title in enumerate(titles[1:], start=2):
+            title_rows.setdefault(title, []).append(row_number)
+        taken = {entry.row for entry in updates + deletes if id(entry) in confirmed}
+        for entry in unresolved:
+            candidates = [row_number for row_number in title_rows.get(str(entry.target), []) if row_number not in taken]
+            if not candidates:
+                entry.row = None
+                results.append((entry, 'failed', f"Rotina '{entry.target}' não encontrada na aba '{sheet_name}'."))
+                continue
+            entry.row = min(candidates, key=lambda row_number: abs(row_number - (entry.row or 0)))
+            taken.add(entry.row)
+        updates = [entry for entry in updates if entry.row is not None]
+        deletes = [entry for entry in deletes if entry.row is not None]
+
+    # 2. Edições: só as células alteradas, todas em uma chamada
+    if updates:
+        data = []
+        for entry in updates:
+            for header, value in entry.data.items():
+                if header in columns:
+                    cell = gspread.utils.rowcol_to_a1(entry.row, columns[header] + 1)
+                    data.append({'range': cell, 'values': [[str(value)]]})
+        try:
+            # O gspread reescreve data[i]['range'] no lugar: cada tentativa recebe uma cópia nova
+            _api_call('batch_update', lambda: worksheet.batch_update([dict(item) for item in data], value_input_option='USER_ENTERED'))
+            results += [(entry, 'ok', None) for entry in updates]
+        except Exception as e:
+            _handle_connection_error(e)
+            results += [(entry, _flush_outcome(e, idempotent=True), _describe_flush_error(e)) for entry in updates]
+
+    # 3. Exclusões: de baixo para cima, para que os índices das demais não mudem
+    if deletes:
+        requests = [
+            {'deleteDimension': {'range': {'sheetId': worksheet.id, 'dimension': 'ROWS',
+                                           'startIndex': row_number - 1, 'endIndex': row_number}}}
+            for row_number in sorted({entry.row for entry in deletes}, reverse=True)
+        ]
+        try:
+            _api_call('delete_rows_batch', worksheet.spreadsheet.batch_update, {'requests': requests}, idempotent=False)
+            results += [(entry, 'ok', None) for entry in deletes]
+        except Exception as e:
+            _handle_connection_error(e)
+            results += [(entry, _flush_outcome(e, idempotent=False), _describe_flush_error(e)) for entry in deletes]
+
+    # 4. Inclusões: todas as novas linhas em uma chamada
+    if appends:
+        values = [[entry.data.get(header.strip(), '') for header in headers] for entry in appends]
+        try:
+            _api_call('append_rows', worksheet.append_rows, values, value_input_option='USER_ENTERED', idempotent=False)
+            results += [(entry, 'ok', None) for entry in appends]
+        except Exception as e:
+            _handle_connection_error(e)
+            results += [(entry, _flush_outcome(e, idempotent=False), _describe_flush_error(e)) for entry in appends]
+
+    # O cache recebeu as alterações quando entraram na fila; se algo não saiu como esperado, ou as
+    # pendências vieram de uma execução anterior, relê a planilha para reconciliar
+    if any(outcome != 'ok' or entry.recovered for entry, outcome, _ in results):
+        _start_background_refresh(_get_dataset_cache())
+    return results
+
+
+@st.cache_resource
+def _get_write_queue() -> WriteQueue:
+    """Fila única por processo, com o worker de gravação já iniciado."""
+    return WriteQueue(WRITE_QUEUE_PATH, _flush_sheet, flush_delay=WRITE_FLUSH_DELAY).start()
+
+
+def get_write_status() -> dict:
+    """Situação das rotinas com gravação na fila: {(aba, _LINHA_PLANILHA da rotina no cache): 'pending' | 'failed'}."""
+    return _get_write_queue().status_by_rotina()
+
+
+def get_write_queue_summary() -> tuple:
+    """Contagem por situação e a lista de mutações pendentes/com falha (DataFrame) para a tela de administração."""
+    queue = _get_write_queue()
+    rows = [{
+        'ID': mutation.id,
+        'SETOR': mutation.sheet,
+        'OPERACAO': {'append': 'inclusão', 'update': 'edição', 'delete': 'exclusão'}.get(mutation.kind, mutation.kind),
+        'ROTINA': mutation.title,
+        'SITUACAO': 'pendente' if mutation.status == PENDING else 'falhou',
+        'TENTATIVAS': mutation.attempts,
+        'ERRO': mutation.error or '',
+        'REGISTRADA_EM': pd.Timestamp(mutation.created_at, unit='s', tz='UTC').tz_convert(None),
+    } for mutation in queue.mutations()]
+    return queue.counts(), pd.DataFrame(rows, columns=['ID', 'SETOR', 'OPERACAO', 'ROTINA', 'SITUACAO', 'TENTATIVAS', 'ERRO', 'REGISTRADA_EM'])
+
+
+def flush_pending_writes() -> dict:
+    """Grava imediatamente as pendências da fila, inclusive as que aguardam nova tentativa."""
+    return _get_write_queue().flush_now(force=True)
+
+
+def retry_failed_writes():
+    """Devolve à fila as gravações que falharam."""
+    _get_write_queue().retry_failed()
+
+
+def discard_failed_writes() -> int:
+    """Descarta as gravações que falharam e reconstrói as abas delas a partir da planilha, desfazendo
+    a alteração no cache. Retorna quantas foram descartadas."""
+    removed = _get_write_queue().discard_failed()
+    if removed:
+        cache = _get_dataset_cache()
+        with cache.lock:
+            _invalidate_tabs(cache, {mutation.sheet for mutation in removed})
+            # Uma recarga em andamento pode ter lido a fila antes do descarte: a nova versão a faz buscar de novo
+            cache.version += 1
+        _start_background_refresh(cache)
+    return len(removed)
+
+
+def _cached_rotina(sheet_name: str, rotina_key: str):
+    """Linha da rotina no cache pela chave do setor (ID_DA_ROTINA ou '#<rótulo>'); None se não existir."""
+    cache = _get_dataset_cache()
+    return None if cache.dataset is None else cache.dataset.get_by_key(sheet_name, rotina_key)
+
+
+def _enqueue(sheet_name: str, kind: str, items: list) -> list:
+    """Registra as alterações [(título, dados, linha)] na fila e devolve as mutações registradas."""
+    ids = _get_write_queue().enqueue_many(sheet_name, kind, items)
+    return [Mutation(mutation_id, sheet_name, kind, str(title), dict(data or {}), row=row)
+            for mutation_id, (title, data, row) in zip(ids, items)]
 
 # --- Função: Escrita no Google Sheets (Create) ---
 
 def append_new_rotina(data: dict, sheet_name: str):
-    """Conecta ao Google Sheets e anexa uma nova linha de dados (Rotina)."""
+    """Registra a nova rotina na fila de gravação e a acrescenta ao cache; a linha é anexada à aba em segundo plano."""
+    return append_rotinas_batch([data], sheet_name)
+
+# --- Função: Inclusão em Lote (Bulk Create) ---
+
+def append_rotinas_batch(records: list, sheet_name: str):
+    """Registra várias rotinas na fila de gravação; a fila as grava na aba com um único append_rows."""
+    if not records:
+        return True
     try:
-        gc = gspread.service_account_from_dict(st.secrets["gcp_service_account"])
-        sh = gc.open_by_key(SPREADSHEET_ID)
-        worksheet = sh.worksheet(sheet_name)
-        
-        headers = worksheet.row_values(1)
-        values = [data.get(header.strip(), '') for header in headers]
-        
-        worksheet.append_row(values, value_input_option='USER_ENTERED')
-        
+        cache = _get_dataset_cache()
+        with cache.write_lock:
+            # As novas rotinas entram logo abaixo da última linha da aba
+            first_row = len(cache.dataset.partition(sheet_name)) + 2 if cache.dataset is not None else None
+            items = [(record.get('TITULO_PROCEDIMENTO', ''), record, first_row + offset if first_row else None)
+                     for offset, record in enumerate(records)]
+            mutations = _enqueue(sheet_name, 'append', items)
+            _apply_write_through(f"inclusão de {len(records)} rotina(s) na aba {sheet_name}", mutations)
         return True
 
     except Exception as e:
-        st.error(f"Erro ao escrever na aba {sheet_name}. Detalhes: {e}")
+        st.error(f"Erro ao registrar {len(records)} rotina(s) para a aba {sheet_name}. Detalhes: {e}")
         return False
 
 # --- Função: Atualizar Rotina Existente (Update) ---
 
-def update_rotina(sheet_name: str, old_title: str, new_data: dict):
-    """Busca uma rotina pelo TITULO_PROCEDIMENTO na aba específica e atualiza sua linha."""
+def update_rotina(sheet_name: str, rotina_key: str, new_data: dict):
+    """Registra a edição da rotina (aba + chave de RotinasDataset.rotina_keys) na fila de gravação e
+    atualiza o cache. A fila recebe a linha e o título atuais, que identificam a rotina mesmo com
+    títulos repetidos na aba."""
     try:
-        gc = gspread.service_account_from_dict(st.secrets["gcp_service_account"])
-        sh = gc.open_by_key(SPREADSHEET_ID)
-        worksheet = sh.worksheet(sheet_name)
-        
-        all_values = worksheet.get_all_values()
-        headers = all_values[0]
-        
-        try:
-            title_col_index = headers.index("TITULO_PROCEDIMENTO")
-        except ValueError:
-            st.error("Coluna 'TITULO_PROCEDIMENTO' não encontrada. Verifique os cabeçalhos do Sheets.")
-            return False
+        cache = _get_dataset_cache()
+        with cache.write_lock:
+            current = _cached_rotina(sheet_name, rotina_key)
+            if current is None:
+                st.warning(f"Rotina '{rotina_key}' não encontrada para edição na aba '{sheet_name}'.")
+                return False
+
+            title = current['TITULO_PROCEDIMENTO']
+            mutations = _enqueue(sheet_name, 'update', [(title, new_data, int(current[ROW_NUMBER_COLUMN]))])
+            _apply_write_through(f"edição de '{title}' na aba {sheet_name}", mutations)
 
-        row_index_to_update = -1
-        for i, row in enumerate(all_values[1:]): 
-            if row[title_col_index] == old_title:
-                row_index_to_update = i + 2 
-                break
-        
-        if row_index_to_update == -1:
-            st.warning(f"Rotina com título '{old_title}' não encontrada para edição na aba '{sheet_name}'.")
-            return False
-            
-        new_values_list = []
-        for header in headers:
-            new_val = new_data.get(header.strip(), all_values[row_index_to_update - 1][headers.index(header)])
-            new_values_list.append(str(new_val))
-
-        range_to_update = f'A{row_index_to_update}:{gspread.utils.rowcol_to_a1(row_index_to_update, len(headers))}'
-        
-        worksheet.update(range_to_update, [new_values_list], value_input_option='USER_ENTERED')
-        
         return True
 
     except Exception as e:
-        st.error(f"Erro ao atualizar a rotina '{old_title}' na aba '{sheet_name}'. Detalhes: {e}")
+        st.error(f"Erro ao registrar a edição da rotina '{rotina_key}' na aba '{sheet_name}'. Detalhes: {e}")
         return False
 
 
 # --- Função: Excluir Rotina (Delete) ---
 
-def delete_rotina(sheet_name: str, title_to_delete: str):
-    """Busca uma rotina pelo TITULO_PROCEDIMENTO na aba específica e a deleta."""
+def delete_rotina(sheet_name: str, rotina_key: str):
+    """Registra a exclusão da rotina (aba + chave de RotinasDataset.rotina_keys) na fila de gravação e
+    a remove do cache."""
     try:
-        gc = gspread.service_account_from_dict(st.secrets["gcp_service_account"]) 
-        sh = gc.open_by_key(SPREADSHEET_ID)
-        worksheet = sh.worksheet(sheet_name)
-        
-        all_values = worksheet.get_all_values()
-        headers = all_values[0]
-        
-        try:
-            title_col_index = headers.index("TITULO_PROCEDIMENTO")
-        except ValueError:
-            st.error("Coluna 'TITULO_PROCEDIMENTO' não encontrada. Verifique os cabeçalhos do Sheets.")
-            return False
+        cache = _get_dataset_cache()
+        with cache.write_lock:
+            current = _cached_rotina(sheet_name, rotina_key)
+            if current is None:
+                st.warning(f"Rotina '{rotina_key}' não encontrada para exclusão na aba '{sheet_name}'.")
+                return False
+
+            title = current['TITULO_PROCEDIMENTO']
+            mutations = _enqueue(sheet_name, 'delete', [(title, None, int(current[ROW_NUMBER_COLUMN]))])
+            _apply_write_through(f"exclusão de '{title}' na aba {sheet_name}", mutations)
 
-        row_index_to_delete = -1
-        for i, row in enumerate(all_values[1:]): 
-            if row[title_col_index] == title_to_delete:
-                row_index_to_delete = i + 2 
-                break
-        
-        if row_index_to_delete == -1:
-            st.warning(f"Rotina com título '{title_to_delete}' não encontrada para exclusão na aba '{sheet_name}'.")
-            return False
-            
-        worksheet.delete_rows(row_index_to_delete)
-        
         return True
 
     except Exception as e:
-        st.error(f"Erro ao deletar a rotina '{title_to_delete}' na aba '{sheet_name}'. Detalhes: {e}")
+        st.error(f"Erro ao registrar a exclusão da rotina '{rotina_key}' na aba '{sheet_name}'. Detalhes: {e}")
         return False
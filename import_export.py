@@ -0,0 +1,132 @@
+# import_export.py
+import io
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+from data_loader import DERIVED_COLUMNS, REQUIRED_COLUMNS, ROW_NUMBER_COLUMN, SHEET_NAMES
+
+# --- Configurações de Importação/Exportação ---
+
+# Colunas obrigatórias no arquivo de importação (as demais de REQUIRED_COLUMNS são opcionais)
+IMPORT_REQUIRED_COLUMNS = ['SETOR', 'TITULO_PROCEDIMENTO', 'ACOES']
+
+# Colunas aceitas no arquivo; a ordem também é a da exportação
+IMPORT_COLUMNS = ['SETOR'] + REQUIRED_COLUMNS
+
+# Linhas por bloco na exportação (a memória usada não cresce com o tamanho da base)
+EXPORT_CHUNK_ROWS = 1000
+
+# --- Leitura do Arquivo ---
+
+def read_import_file(file, file_name: str) -> pd.DataFrame:
+    """Lê um CSV (vírgula ou ponto e vírgula) ou XLSX com todas as células como texto.
+
+    XLSX exige o pacote opcional openpyxl; sem ele, levanta ValueError com a orientação."""
+    if file_name.lower().endswith('.xlsx'):
+        try:
+            df = pd.read_excel(file, dtype=str, engine='openpyxl')
+        except ImportError:
+            raise ValueError("Para importar arquivos XLSX instale o pacote 'openpyxl' ou envie o arquivo em CSV.")
+        df = df.fillna('')
+    else:
+        # sep=None detecta o separador (o Excel em português salva CSV com ';')
+        df = pd.read_csv(file, dtype=str, keep_default_na=False, sep=None, engine='python', encoding='utf-8-sig')
+        # keep_default_na não cobre linhas com campos finais faltando: elas chegam como NaN
+        df = df.fillna('')
+
+    df.columns = [str(column).strip().upper() for column in df.columns]
+    return df
+
+# --- Validação (Dry-Run) ---
+
+@dataclass
+class ImportPreview:
+    """Resultado da validação do arquivo, antes de qualquer escrita na planilha.
+
+    `rows` traz as rotinas normalizadas com a linha de origem no arquivo (LINHA) e os problemas
+    encontrados (PROBLEMAS, vazio quando a linha pode ser importada)."""
+    rows: pd.DataFrame
+    ignored_columns: list = field(default_factory=list)
+    missing_columns: list = field(default_factory=list)
+
+    @property
+    def valid_rows(self) -> pd.DataFrame:
+        return self.rows[self.rows['PROBLEMAS'] == '']
+
+    @property
+    def invalid_count(self) -> int:
+        return int((self.rows['PROBLEMAS'] != '').sum())
+
+    def records_by_sheet(self) -> dict:
+        """Rotinas válidas agrupadas por aba de destino, no formato usado por append_rotinas_batch."""
+        records = {}
+        for setor, group in self.valid_rows.groupby('SETOR', sort=False):
+            records[setor] = group[REQUIRED_COLUMNS].to_dict('records')
+        return records
+
+
+def validate_import(df: pd.DataFrame, dataset) -> ImportPreview:
+    """Valida cada linha do arquivo: setor existente, título e ações preenchidos, título sem
+    repetição no arquivo e ainda não cadastrado na aba de destino."""
+    missing = [column for column in IMPORT_REQUIRED_COLUMNS if column not in df.columns]
+    ignored = [column for column in df.columns if column not in IMPORT_COLUMNS]
+
+    rows = pd.DataFrame({column: df[column].fillna('').astype(str).str.strip() if column in df.columns else '' for column in IMPORT_COLUMNS}, index=df.index)
+    rows['SETOR'] = rows['SETOR'].str.upper()
+    # Mesmo formato do formulário: uma ação por linha vira o separador '#'
+    rows['ACOES'] = rows['ACOES'].str.replace('\r\n', '\n', regex=False).str.replace('\n', '#', regex=False)
+    # Linha no arquivo, contando o cabeçalho como linha 1
+    rows.insert(0, 'LINHA', range(2, len(rows) + 2))
+
+    problems = [[] for _ in range(len(rows))]
+
+    def flag(mask, message):
+        for position in mask.to_numpy().nonzero()[0]:
+            problems[position].append(message)
+
+    flag(~rows['SETOR'].isin(SHEET_NAMES), "Setor inexistente")
+    flag(rows['TITULO_PROCEDIMENTO'] == '', "Título vazio")
+    flag(rows['ACOES'].str.strip('# ') == '', "Ações vazias")
+    flag(rows.duplicated(['SETOR', 'TITULO_PROCEDIMENTO'], keep='first') & (rows['TITULO_PROCEDIMENTO'] != ''), "Título repetido no arquivo")
+
+    existing = set()
+    for setor in SHEET_NAMES:
+        partition = dataset.partition(setor)
+        if 'TITULO_PROCEDIMENTO' in partition.columns:
+            existing.update((setor, title) for title in partition['TITULO_PROCEDIMENTO'].tolist())
+    keys = pd.Series(list(zip(rows['SETOR'], rows['TITULO_PROCEDIMENTO'])), index=rows.index)
+    flag(keys.map(lambda key: key in existing), "Título já cadastrado no setor")
+
+    rows['PROBLEMAS'] = ['; '.join(items) for items in problems]
+    if missing:
+        rows['PROBLEMAS'] = f"Colunas obrigatórias ausentes no arquivo: {', '.join(missing)}"
+    return ImportPreview(rows=rows.reset_index(drop=True), ignored_columns=ignored, missing_columns=missing)
+
+# --- Exportação em Blocos ---
+
+def export_columns(dataset) -> list:
+    """Colunas da planilha presentes no conjunto (sem as derivadas e internas), SETOR primeiro."""
+    internal = set(DERIVED_COLUMNS) | {ROW_NUMBER_COLUMN}
+    extra = [column for column in dataset.columns if column not in internal and column not in IMPORT_COLUMNS]
+    return IMPORT_COLUMNS + extra
+
+
+def iter_export_csv(dataset, columns: list = None):
+    """Gera o CSV de todas as rotinas em blocos de bytes, setor a setor, sem montar o arquivo inteiro.
+
+    O formato é o mesmo aceito pela importação (UTF-8 com BOM para abrir direto no Excel)."""
+    columns = columns or export_columns(dataset)
+    yield pd.DataFrame(columns=columns).to_csv(index=False).encode('utf-8-sig')
+    for partition in dataset.partitions().values():
+        for start in range(0, len(partition), EXPORT_CHUNK_ROWS):
+            chunk = partition.iloc[start:start + EXPORT_CHUNK_ROWS].reindex(columns=columns)
+            yield chunk.to_csv(index=False, header=False).encode('utf-8')
+
+
+def export_csv_bytes(dataset) -> bytes:
+    """Arquivo CSV completo, montado a partir dos blocos de iter_export_csv."""
+    buffer = io.BytesIO()
+    for chunk in iter_export_csv(dataset):
+        buffer.write(chunk)
+    return buffer.getvalue()
@@ -0,0 +1,167 @@
+# rotinas_dataset.py
+import threading
+from collections import Counter
+
+import pandas as pd
+import pyarrow as pa
+
+# Coluna interna com o número da linha de cada rotina na sua aba (cabeçalho = linha 1)
+ROW_NUMBER_COLUMN = '_LINHA_PLANILHA'
+
+# --- Tipos Compactos ---
+
+# Texto em Arrow: bem menor que objetos str do Python e sem cópias ao fatiar
+TEXT_DTYPE = pd.StringDtype('pyarrow')
+
+# Listas pré-calculadas na carga (passos e anexos)
+LIST_DTYPE = pd.ArrowDtype(pa.list_(pa.string()))
+LIST_COLUMNS = ('PASSOS', 'ANEXOS', 'ANEXOS_TIPOS')
+
+# Colunas com poucos valores distintos que se repetem em muitas linhas
+CATEGORY_COLUMNS = ('FLUXO_PRINCIPAL',)
+
+
+def compact_partition(df: pd.DataFrame, setores: list) -> pd.DataFrame:
+    """Converte uma partição para dtypes compactos: SETOR e FLUXO_PRINCIPAL categóricos, listas em
+    Arrow, número da linha em int32 e as demais colunas como texto Arrow (células vazias viram '')."""
+    columns = {}
+    for column in df.columns:
+        values = df[column]
+        if column == 'SETOR':
+            columns[column] = values.astype(pd.CategoricalDtype(setores))
+        elif column in LIST_COLUMNS:
+            columns[column] = values if values.dtype == LIST_DTYPE else values.astype(LIST_DTYPE)
+        elif column in CATEGORY_COLUMNS:
+            columns[column] = values if isinstance(values.dtype, pd.CategoricalDtype) else values.fillna('').astype(str).astype('category')
+        elif column == ROW_NUMBER_COLUMN:
+            columns[column] = values.astype('int32')
+        elif values.dtype == TEXT_DTYPE:
+            columns[column] = values
+        else:
+            columns[column] = values.astype(TEXT_DTYPE).fillna('')
+    return pd.DataFrame(columns, index=df.index)
+
+# --- Conjunto de Dados Particionado por Setor ---
+
+class RotinasDataset:
+    """Rotinas de todos os setores, com uma partição (DataFrame compacto) por setor.
+
+    As partições são entregues sem cópia e não devem ser alteradas: com Copy-on-Write (padrão no
+    pandas 3) qualquer alteração feita por quem as recebe gera uma cópia e não afeta o conjunto.
+    Mudanças geram um novo RotinasDataset que reaproveita as partições não alteradas. Os rótulos
+    de índice são únicos entre todas as partições e identificam a linha enquanto ela existir."""
+
+    def __init__(self, partitions: dict, setores: list, next_label: int):
+        self._partitions = partitions
+        self._all_setores = list(setores)
+        self.next_label = next_label
+        self.row_counts = {setor: len(partitions[setor]) for setor in self._all_setores if setor in partitions}
+        self.setores = sorted(setor for setor, count in self.row_counts.items() if count)
+        self._frame = None
+        self._frame_lock = threading.Lock()
+        self._keys = {}
+
+    @classmethod
+    def from_partitions(cls, frames: dict, setores: list) -> 'RotinasDataset':
+        """Monta o conjunto a partir de DataFrames por setor, atribuindo rótulos novos a todas as linhas."""
+        return cls({}, setores, 0).replace_partitions(frames)
+
+    def replace_partitions(self, frames: dict) -> 'RotinasDataset':
+        """Novo conjunto com as partições informadas substituídas (com rótulos novos) e as demais reaproveitadas."""
+        partitions = dict(self._partitions)
+        next_label = self.next_label
+        for setor, frame in frames.items():
+            frame = frame.set_axis(pd.RangeIndex(next_label, next_label + len(frame)), axis=0)
+            next_label += len(frame)
+            partitions[setor] = compact_partition(frame, self._all_setores)
+        return RotinasDataset(partitions, self._all_setores, next_label)
+
+    def with_partition(self, setor: str, frame: pd.DataFrame, next_label: int = None) -> 'RotinasDataset':
+        """Novo conjunto com uma partição já rotulada substituída (usado nas atualizações write-through)."""
+        partitions = dict(self._partitions)
+        partitions[setor] = compact_partition(frame, self._all_setores)
+        return RotinasDataset(partitions, self._all_setores, next_label if next_label is not None else self.next_label)
+
+    # --- Leitura ---
+
+    def partition(self, setor: str) -> pd.DataFrame:
+        """Rotinas de um setor (sem cópia)."""
+        partition = self._partitions.get(setor)
+        if partition is None:
+            return pd.DataFrame(columns=self.columns)
+        return partition
+
+    def partitions(self) -> dict:
+        """Todas as partições, por setor, na ordem das abas."""
+        return {setor: self._partitions[setor] for setor in self._all_setores if setor in self._partitions}
+
+    def to_frame(self) -> pd.DataFrame:
+        """Todas as rotinas em um único DataFrame (montado uma vez por conjunto e reaproveitado)."""
+        with self._frame_lock:
+            if self._frame is None:
+                frames = [partition for partition in self.partitions().values() if len(partition)]
+                if frames:
+                    frame = pd.concat(frames)
+                    for column in CATEGORY_COLUMNS:
+                        if column in frame.columns:
+                            frame[column] = frame[column].astype(str).astype('category')
+                    self._frame = frame
+                else:
+                    self._frame = pd.DataFrame(columns=self.columns)
+            return self._frame
+
+    # --- Índice por (Setor, ID da Rotina) ---
+
+    def _key_index(self, setor: str) -> dict:
+        """Índice da partição, montado na primeira consulta: chaves ordenadas por título, chave -> rótulo
+        e rótulo -> chave. A chave é o ID_DA_ROTINA; IDs vazios ou repetidos no setor usam '#<rótulo>'."""
+        with self._frame_lock:
+            index = self._keys.get(setor)
+            if index is not None:
+                return index
+
+            partition = self.partition(setor)
+            if partition.empty or 'ID_DA_ROTINA' not in partition.columns:
+                ids = [''] * len(partition)
+            else:
+                ids = partition['ID_DA_ROTINA'].tolist()
+            counts = Counter(ids)
+            labels = partition.index.tolist()
+            keys = [rotina_id if rotina_id and counts[rotina_id] == 1 else f"#{label}" for rotina_id, label in zip(ids, labels)]
+
+            titles = partition['TITULO_PROCEDIMENTO'].tolist() if 'TITULO_PROCEDIMENTO' in partition.columns else [''] * len(partition)
+            order = sorted(range(len(keys)), key=lambda position: (titles[position].casefold(), keys[position]))
+            index = {
+                'keys': [keys[position] for position in order],
+                'labels': dict(zip(keys, labels)),
+                'by_label': dict(zip(labels, keys)),
+            }
+            self._keys[setor] = index
+            return index
+
+    def rotina_keys(self, setor: str) -> list:
+        """Chaves das rotinas do setor, em ordem alfabética de título."""
+        return self._key_index(setor)['keys']
+
+    def key_for_label(self, setor: str, label):
+        """Chave de uma linha a partir do seu rótulo (ex.: resultados da busca)."""
+        return self._key_index(setor)['by_label'].get(label)
+
+    def get_by_key(self, setor: str, key: str):
+        """Linha da rotina pelo setor e chave (O(1)); None se não existir nesta versão dos dados."""
+        label = self._key_index(setor)['labels'].get(key)
+        return None if label is None else self._partitions[setor].loc[label]
+
+    @property
+    def columns(self) -> list:
+        for partition in self._partitions.values():
+            if len(partition.columns):
+                return list(partition.columns)
+        return []
+
+    @property
+    def empty(self) -> bool:
+        return not any(self.row_counts.values())
+
+    def __len__(self) -> int:
+        return sum(self.row_counts.values())
@@ -0,0 +1,109 @@
+# search_index.py
+import bisect
+import re
+import unicodedata
+from collections import defaultdict
+
+import pandas as pd
+
+# --- Configurações da Busca ---
+
+# Campos indexados e o peso de cada um na relevância do resultado
+SEARCH_FIELDS = {
+    'TITULO_PROCEDIMENTO': 4.0,
+    'FLUXO_PRINCIPAL': 2.0,
+    'ACOES': 1.0,
+    'OBSERVACOES': 1.0,
+}
+
+# Termo idêntico ao token vale mais do que um token que apenas começa com o termo
+EXACT_MATCH_BONUS = 1.5
+
+# Termos mais curtos que isso só casam com tokens idênticos (evita expandir "a" para o vocabulário todo)
+MIN_PREFIX_LENGTH = 2
+
+_TOKEN_RE = re.compile(r'\w+')
+
+# --- Normalização de Texto ---
+
+def fold_text(text) -> str:
+    """Remove acentos e diferenças de caixa: 'Intubação' -> 'intubacao'."""
+    if text is None or (not isinstance(text, str) and pd.isna(text)):
+        return ''
+    decomposed = unicodedata.normalize('NFKD', str(text))
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch)).casefold()
+
+
+def tokenize(text) -> list:
+    """Quebra o texto normalizado em palavras."""
+    return _TOKEN_RE.findall(fold_text(text))
+
+# --- Índice Invertido ---
+
+class SearchIndex:
+    """Índice invertido por token sobre as rotinas de todos os setores.
+
+    Construído uma vez por versão do conjunto de dados; as buscas consultam apenas os
+    tokens do vocabulário que casam com os termos, sem varrer as linhas do DataFrame."""
+
+    def __init__(self, df: pd.DataFrame):
+        self.row_labels = list(df.index)
+        self._setores = df['SETOR'].tolist() if 'SETOR' in df.columns else [None] * len(df)
+
+        postings = defaultdict(dict)
+        for field, weight in SEARCH_FIELDS.items():
+            if field not in df.columns:
+                continue
+            for position, value in enumerate(df[field].tolist()):
+                for token in set(tokenize(value)):
+                    doc_scores = postings[token]
+                    doc_scores[position] = doc_scores.get(position, 0.0) + weight
+
+        self._postings = dict(postings)
+        self._vocabulary = sorted(self._postings)
+
+    def __len__(self) -> int:
+        return len(self.row_labels)
+
+    def _matching_tokens(self, term: str) -> list:
+        """Tokens do vocabulário iguais ao termo ou, a partir de MIN_PREFIX_LENGTH, que começam com ele."""
+        if len(term) < MIN_PREFIX_LENGTH:
+            return [term] if term in self._postings else []
+
+        start = bisect.bisect_left(self._vocabulary, term)
+        tokens = []
+        for token in self._vocabulary[start:]:
+            if not token.startswith(term):
+                break
+            tokens.append(token)
+        return tokens
+
+    def search(self, query: str, setor: str = None, limit: int = None) -> list:
+        """Retorna os rótulos das linhas que contêm todos os termos da busca, do mais ao menos relevante."""
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        scores = None
+        for term in terms:
+            term_scores = {}
+            for token in self._matching_tokens(term):
+                bonus = EXACT_MATCH_BONUS if token == term else 1.0
+                for position, weight in self._postings[token].items():
+                    term_scores[position] = max(term_scores.get(position, 0.0), weight * bonus)
+
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {pos: scores[pos] + term_scores[pos] for pos in scores.keys() & term_scores.keys()}
+            if not scores:
+                return []
+
+        positions = scores.keys()
+        if setor is not None:
+            positions = [pos for pos in positions if self._setores[pos] == setor]
+
+        ranked = sorted(positions, key=lambda pos: (-scores[pos], pos))
+        if limit is not None:
+            ranked = ranked[:limit]
+        return [self.row_labels[pos] for pos in ranked]
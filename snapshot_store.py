@@ -0,0 +1,88 @@
+# snapshot_store.py
+import json
+import os
+import sqlite3
+import tempfile
+from dataclasses import dataclass
+
+import pandas as pd
+
+# --- Snapshot Local em Disco (SQLite) ---
+
+# Incrementar sempre que o formato da tabela/metadados mudar; snapshots antigos são ignorados.
+SNAPSHOT_SCHEMA_VERSION = 3
+
+
+@dataclass
+class Snapshot:
+    """Último conjunto de dados válido salvo em disco, com versão e horário da carga original."""
+    df: pd.DataFrame
+    headers: dict
+    version: int
+    loaded_at: pd.Timestamp
+    state: dict
+
+
+def _quote(identifier: str) -> str:
+    """Escapa um nome de coluna para uso em SQL."""
+    return '"' + str(identifier).replace('"', '""') + '"'
+
+
+def save_snapshot(path: str, df: pd.DataFrame, headers: dict, version: int, loaded_at: pd.Timestamp, state: dict = None):
+    """Grava o DataFrame em um arquivo SQLite de forma atômica (arquivo temporário + rename).
+
+    `state` guarda metadados livres do carregador (ex.: detecção de mudanças) em JSON."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    os.close(fd)
+    try:
+        conn = sqlite3.connect(tmp_path)
+        try:
+            # Colunas sem tipo declarado preservam o tipo de cada valor (int, float ou texto)
+            columns = ', '.join(_quote(col) for col in df.columns)
+            placeholders = ', '.join('?' for _ in df.columns)
+            conn.execute(f'CREATE TABLE rotinas ({columns})')
+            rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+            conn.executemany(f'INSERT INTO rotinas VALUES ({placeholders})', rows)
+
+            conn.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+            conn.executemany('INSERT INTO meta VALUES (?, ?)', [
+                ('schema_version', str(SNAPSHOT_SCHEMA_VERSION)),
+                ('version', str(version)),
+                ('loaded_at', loaded_at.isoformat()),
+                ('headers', json.dumps(headers, ensure_ascii=False)),
+                ('state', json.dumps(state or {}, ensure_ascii=False)),
+            ])
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_snapshot(path: str):
+    """Lê o snapshot salvo em disco. Retorna None se não existir ou for de outra versão de esquema."""
+    if not os.path.exists(path):
+        return None
+
+    conn = sqlite3.connect(path)
+    try:
+        meta = dict(conn.execute('SELECT key, value FROM meta').fetchall())
+        if meta.get('schema_version') != str(SNAPSHOT_SCHEMA_VERSION):
+            return None
+
+        df = pd.read_sql_query('SELECT * FROM rotinas', conn, dtype=object)
+        return Snapshot(
+            df=df,
+            headers=json.loads(meta.get('headers', '{}')),
+            version=int(meta['version']),
+            loaded_at=pd.Timestamp(meta['loaded_at']),
+            state=json.loads(meta.get('state', '{}')),
+        )
+    finally:
+        conn.close()
@@ -0,0 +1,108 @@
+# telemetry.py
+import json
+import logging
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+
+import pandas as pd
+
+logger = logging.getLogger('sgc.telemetry')
+
+# --- Configurações da Telemetria ---
+
+# Durações guardadas por span (janela das estatísticas p50/p95)
+SPAN_WINDOW = 500
+
+# Janela usada para eventos por minuto (ex.: chamadas à API contra a cota)
+RATE_WINDOW_SECONDS = 60
+
+# --- Registro de Spans e Contadores ---
+
+class Telemetry:
+    """Durações recentes por span, contadores e horários de eventos, em memória e por processo.
+
+    Cada registro custa um perf_counter e um append em deque: pode ficar ligado em produção.
+    Com o logger 'sgc.telemetry' em INFO, cada span também vira um registro JSON no log."""
+
+    def __init__(self, window: int = SPAN_WINDOW):
+        self._lock = threading.Lock()
+        self._durations = defaultdict(lambda: deque(maxlen=window))
+        self._totals = Counter()
+        self._errors = Counter()
+        self._events = defaultdict(lambda: deque(maxlen=10000))
+        self.counters = Counter()
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        """Mede o bloco e registra a duração em `name`; exceções são contadas e propagadas."""
+        start = time.perf_counter()
+        error = None
+        try:
+            yield attrs
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.record(name, time.perf_counter() - start, error=error, **attrs)
+
+    def record(self, name: str, duration: float, error: BaseException = None, **attrs):
+        """Registra uma duração já medida."""
+        with self._lock:
+            self._durations[name].append(duration)
+            self._totals[name] += 1
+            if error is not None:
+                self._errors[name] += 1
+
+        if logger.isEnabledFor(logging.INFO):
+            record = {'span': name, 'ms': round(duration * 1000, 3), **attrs}
+            if error is not None:
+                record['error'] = type(error).__name__
+            logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+    def increment(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def mark(self, name: str):
+        """Registra o horário de um evento, para taxas por minuto."""
+        with self._lock:
+            self._events[name].append(time.monotonic())
+
+    def rate_per_minute(self, name: str) -> int:
+        """Eventos `name` nos últimos RATE_WINDOW_SECONDS segundos."""
+        cutoff = time.monotonic() - RATE_WINDOW_SECONDS
+        with self._lock:
+            return sum(1 for moment in self._events[name] if moment >= cutoff)
+
+    def summary(self) -> pd.DataFrame:
+        """Estatísticas por span: execuções, erros, p50, p95 e máximo da janela recente (ms)."""
+        with self._lock:
+            snapshot = {name: sorted(durations) for name, durations in self._durations.items() if durations}
+            totals, errors = dict(self._totals), dict(self._errors)
+
+        rows = []
+        for name, durations in sorted(snapshot.items()):
+            rows.append({
+                'SPAN': name,
+                'EXECUCOES': totals.get(name, 0),
+                'ERROS': errors.get(name, 0),
+                'P50_MS': round(_percentile(durations, 0.50) * 1000, 1),
+                'P95_MS': round(_percentile(durations, 0.95) * 1000, 1),
+                'MAX_MS': round(durations[-1] * 1000, 1),
+            })
+        return pd.DataFrame(rows, columns=['SPAN', 'EXECUCOES', 'ERROS', 'P50_MS', 'P95_MS', 'MAX_MS'])
+
+    def get_counters(self) -> dict:
+        with self._lock:
+            return dict(self.counters)
+
+
+def _percentile(ordered: list, fraction: float) -> float:
+    """Percentil por posição mais próxima de uma lista já ordenada."""
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+# Instância única por processo, compartilhada por todas as sessões
+TELEMETRY = Telemetry()
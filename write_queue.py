@@ -0,0 +1,332 @@
+# write_queue.py
+import bisect
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+logger = logging.getLogger(__name__)
+
+# --- Configurações da Fila de Gravação ---
+
+# Espera após a primeira alteração antes de gravar, para juntar edições em sequência na mesma aba
+DEFAULT_FLUSH_DELAY = 2.0        # segundos
+
+# Nova tentativa de lotes que falharam por cota/instabilidade
+RETRY_DELAY = 30.0               # segundos
+
+# Tentativas antes de a mutação ser marcada como falha (fica aguardando ação do administrador)
+MAX_ATTEMPTS = 10
+
+PENDING = 'pending'
+FAILED = 'failed'
+
+# --- Mutações ---
+
+@dataclass
+class Mutation:
+    """Alteração registrada no diário: inclusão, edição ou exclusão de uma rotina em uma aba.
+
+    `row` é a linha da rotina na aba com as mutações anteriores já aplicadas (a mesma do cache
+    no momento do registro); para append, a linha em que a nova rotina entra."""
+    id: int
+    sheet: str
+    kind: str            # 'append' | 'update' | 'delete'
+    title: str           # título da rotina alvo (para append, o título da nova rotina)
+    data: dict
+    status: str = PENDING
+    error: str = None
+    created_at: float = 0.0
+    attempts: int = 0
+    next_attempt_at: float = 0.0
+    row: int = None
+
+
+@dataclass
+class NetMutation:
+    """Efeito líquido de uma ou mais mutações sobre a mesma rotina, pronto para gravar."""
+    kind: str            # 'append' | 'update' | 'delete' | 'noop'
+    target: str          # título atual na planilha (None para append)
+    title: str           # título após a gravação
+    data: dict = field(default_factory=dict)
+    ids: list = field(default_factory=list)
+    recovered: bool = False
+    row: int = None      # linha atual na planilha, antes da gravação (None se desconhecida ou append)
+
+
+def coalesce(mutations: list) -> list:
+    """Consolida as mutações de uma aba (em ordem) em no máximo uma por rotina.
+
+    Edições seguidas viram uma só (inclusive com troca de título), edição após inclusão é
+    incorporada à inclusão, exclusão após inclusão anula as duas e exclusão após edição vira
+    só a exclusão. As rotinas são identificadas pela linha: a de cada mutação (que já considera
+    as anteriores) é convertida para a linha na planilha antes da gravação, descontando as
+    exclusões anteriores; linhas a partir da primeira inclusão apontam para as inclusões."""
+    net = []
+    by_row = {}          # linha na planilha -> edição/exclusão consolidada
+    deleted = []         # linhas na planilha já excluídas pelas mutações anteriores (em ordem)
+    appended = []        # inclusões ainda vivas, na ordem em que ficam no fim da aba
+    first_appended = None
+    for mutation in mutations:
+        if mutation.kind == 'append':
+            entry = NetMutation('append', None, mutation.title, dict(mutation.data), [mutation.id])
+            net.append(entry)
+            if first_appended is None and mutation.row is not None:
+                first_appended = mutation.row - len(appended)
+            appended.append(entry)
+            continue
+
+        row = mutation.row
+        if row is None:
+            # Mutação sem linha (diário antigo): a rotina é identificada só pelo título
+            entry = next((item for item in reversed(net) if item.kind in ('append', 'update') and item.title == mutation.title), None)
+        elif first_appended is not None and row >= first_appended:
+            position = row - first_appended
+            entry = appended[position] if position < len(appended) else None
+            row = None
+        else:
+            for deleted_row in deleted:
+                if deleted_row <= row:
+                    row += 1
+            entry = by_row.get(row)
+
+        if mutation.kind == 'update':
+            if entry is None:
+                entry = NetMutation('update', mutation.title, mutation.title, row=row)
+                net.append(entry)
+                if row is not None:
+                    by_row[row] = entry
+            entry.data.update(mutation.data)
+            entry.ids.append(mutation.id)
+            entry.title = str(mutation.data.get('TITULO_PROCEDIMENTO', entry.title))
+            continue
+
+        if entry is None:
+            entry = NetMutation('delete', mutation.title, mutation.title, ids=[mutation.id], row=row)
+            net.append(entry)
+        else:
+            entry.ids.append(mutation.id)
+            entry.data = {}
+            if entry.kind == 'append':
+                entry.kind = 'noop'
+                appended.remove(entry)
+                continue
+            entry.kind = 'delete'
+        # As linhas abaixo da excluída sobem uma posição, inclusive as das inclusões
+        if entry.row is not None:
+            bisect.insort(deleted, entry.row)
+            if first_appended is not None:
+                first_appended -= 1
+    return net
+
+# --- Fila Durável (Diário em SQLite) ---
+
+class WriteQueue:
+    """Fila de gravações no Sheets registrada em disco antes de ser aplicada.
+
+    Cada alteração é gravada no diário (SQLite) e confirmada ao chamador imediatamente. Um worker
+    em segundo plano espera `flush_delay` segundos, consolida as pendências de cada aba e chama
+    `flush(aba, [NetMutation])`, que devolve [(NetMutation, 'ok' | 'retry' | 'failed', erro)].
+    Pendências que sobrevivem a um reinício são gravadas quando o worker é iniciado de novo."""
+
+    def __init__(self, path: str, flush, flush_delay: float = DEFAULT_FLUSH_DELAY, retry_delay: float = RETRY_DELAY,
+                 max_attempts: int = MAX_ATTEMPTS):
+        self.path = path
+        self.flush = flush
+        self.flush_delay = flush_delay
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._worker = None
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=FULL')
+        self._conn.execute('''CREATE TABLE IF NOT EXISTS mutations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sheet TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            title TEXT NOT NULL,
+            data TEXT NOT NULL,
+            status TEXT NOT NULL,
+            error TEXT,
+            created_at REAL NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0,
+            sheet_row INTEGER
+        )''')
+        # Diários criados antes da coluna da linha: as mutações antigas ficam sem linha (busca por título)
+        columns = [info[1] for info in self._conn.execute('PRAGMA table_info(mutations)')]
+        if 'sheet_row' not in columns:
+            self._conn.execute('ALTER TABLE mutations ADD COLUMN sheet_row INTEGER')
+
+    # --- Registro ---
+
+    def enqueue_many(self, sheet: str, kind: str, items: list) -> list:
+        """Registra várias alterações do mesmo tipo, [(título, dados, linha)], em uma única transação."""
+        now = time.time()
+        ids = []
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                for title, data, row in items:
+                    cursor = self._conn.execute(
+                        'INSERT INTO mutations (sheet, kind, title, data, status, created_at, sheet_row) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (sheet, kind, str(title), json.dumps(data or {}, ensure_ascii=False), PENDING, now, row))
+                    ids.append(cursor.lastrowid)
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        self._wakeup.set()
+        return ids
+
+    def _select(self, where: str, params: tuple = ()) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT id, sheet, kind, title, data, status, error, created_at, attempts, next_attempt_at, sheet_row '
+                f'FROM mutations {where} ORDER BY id', params).fetchall()
+        return [Mutation(id, sheet, kind, title, json.loads(data), status, error, created_at, attempts, next_attempt_at, row)
+                for id, sheet, kind, title, data, status, error, created_at, attempts, next_attempt_at, row in rows]
+
+    def mutations(self) -> list:
+        """Todas as mutações pendentes ou com falha, em ordem de registro."""
+        return self._select('')
+
+    def status_by_rotina(self) -> dict:
+        """{(aba, linha atual da rotina): 'pending' | 'failed'}; com falha prevalece sobre pendente.
+
+        A linha registrada em cada mutação é levada adiante pelas exclusões seguintes da mesma aba,
+        chegando à linha da rotina no cache (que já tem todas as mutações aplicadas). Assim rotinas
+        com o mesmo título têm situações independentes. Mutações sem linha (diário antigo) ficam de fora."""
+        statuses = {}
+        for mutation in self.mutations():
+            if mutation.row is None:
+                continue
+            if mutation.kind == 'delete':
+                # A rotina excluída sai do cache e as linhas abaixo dela sobem uma posição
+                statuses = {(sheet, row - 1 if sheet == mutation.sheet and row > mutation.row else row): status
+                            for (sheet, row), status in statuses.items()
+                            if (sheet, row) != (mutation.sheet, mutation.row)}
+                continue
+            key = (mutation.sheet, mutation.row)
+            if statuses.get(key) != FAILED:
+                statuses[key] = mutation.status
+        return statuses
+
+    def counts(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute('SELECT status, COUNT(*) FROM mutations GROUP BY status').fetchall()
+        return {PENDING: 0, FAILED: 0, **dict(rows)}
+
+    def retry_failed(self):
+        """Volta as mutações com falha para a fila."""
+        with self._lock:
+            self._conn.execute('UPDATE mutations SET status = ?, error = NULL, attempts = 0, next_attempt_at = 0 WHERE status = ?', (PENDING, FAILED))
+        self._wakeup.set()
+
+    def discard_failed(self) -> list:
+        """Descarta as mutações com falha. Retorna as mutações removidas."""
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                rows = self._conn.execute('SELECT id, sheet, kind, title FROM mutations WHERE status = ? ORDER BY id', (FAILED,)).fetchall()
+                self._conn.execute('DELETE FROM mutations WHERE status = ?', (FAILED,))
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return [Mutation(id, sheet, kind, title, {}, FAILED) for id, sheet, kind, title in rows]
+
+    @contextmanager
+    def hold_flushes(self):
+        """Impede gravações no Sheets enquanto o bloco roda (aguardando a que estiver em andamento):
+        o que for lido da planilha e do diário dentro dele é consistente entre si."""
+        with self._flush_lock:
+            yield
+
+    # --- Gravação ---
+
+    def flush_now(self, force: bool = False) -> dict:
+        """Grava agora as pendências das abas cuja mutação mais antiga já venceu (todas, com force=True),
+        aba por aba. Retorna {aba: [resultados]}.
+
+        As pendências de uma aba saem sempre juntas: enquanto a mais antiga aguarda nova tentativa, as
+        seguintes esperam com ela (uma edição nunca é gravada antes da renomeação que a precede)."""
+        with self._flush_lock:
+            due = float('inf') if force else time.time()
+            by_sheet = {}
+            for mutation in self._select('WHERE status = ?', (PENDING,)):
+                by_sheet.setdefault(mutation.sheet, []).append(mutation)
+
+            results = {}
+            for sheet, mutations in by_sheet.items():
+                if mutations[0].next_attempt_at > due:
+                    continue
+                # Uma falha anterior na mesma aba bloqueia as seguintes, preservando a ordem das alterações
+                if self._select('WHERE sheet = ? AND status = ? AND id < ?', (sheet, FAILED, mutations[0].id)):
+                    continue
+                entries = coalesce(mutations)
+                for entry in entries:
+                    entry.recovered = any(m.created_at < self.started_at for m in mutations if m.id in entry.ids)
+                try:
+                    outcomes = self.flush(sheet, [entry for entry in entries if entry.kind != 'noop'])
+                except Exception as e:
+                    logger.warning("Falha ao gravar a fila da aba %s: %s", sheet, e)
+                    outcomes = [(entry, 'retry', str(e)) for entry in entries if entry.kind != 'noop']
+                outcomes += [(entry, 'ok', None) for entry in entries if entry.kind == 'noop']
+                self._apply_outcomes(outcomes)
+                results[sheet] = outcomes
+            return results
+
+    def _apply_outcomes(self, outcomes: list):
+        now = time.time()
+        with self._lock:
+            for entry, outcome, error in outcomes:
+                placeholders = ', '.join('?' for _ in entry.ids)
+                if outcome == 'ok':
+                    self._conn.execute(f'DELETE FROM mutations WHERE id IN ({placeholders})', entry.ids)
+                elif outcome == 'retry':
+                    self._conn.execute(
+                        f'UPDATE mutations SET attempts = attempts + 1, error = ?, next_attempt_at = ? WHERE id IN ({placeholders})',
+                        (error, now + self.retry_delay, *entry.ids))
+                    self._conn.execute(
+                        f'UPDATE mutations SET status = ? WHERE attempts >= ? AND id IN ({placeholders})',
+                        (FAILED, self.max_attempts, *entry.ids))
+                else:
+                    self._conn.execute(
+                        f'UPDATE mutations SET attempts = attempts + 1, status = ?, error = ? WHERE id IN ({placeholders})',
+                        (FAILED, error, *entry.ids))
+
+    # --- Worker em Segundo Plano ---
+
+    def start(self):
+        """Inicia o worker (uma vez); pendências de execuções anteriores são gravadas logo em seguida."""
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run, name='sgc-write-queue', daemon=True)
+            self._worker.start()
+            if self.counts()[PENDING]:
+                self._wakeup.set()
+        return self
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(timeout=self.retry_delay)
+            self._wakeup.clear()
+            if not self.counts()[PENDING]:
+                continue
+            # Junta as alterações feitas em sequência antes de gravar
+            time.sleep(self.flush_delay)
+            try:
+                self.flush_now()
+            except Exception as e:
+                logger.warning("Falha no worker da fila de gravação: %s", e)